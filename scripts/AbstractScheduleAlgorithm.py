@@ -1,28 +1,98 @@
+import numpy as np
 import pandas as pd
 import datetime
 from abc import ABC, abstractmethod
+from .CapacityLedger import CapacityLedger, week_ordinal, week_ordinals
+from .Constraints import ConstraintRegistry
+from .Instrumentation import Metrics
+from .SharedInputs import SharedScheduleInputs
+
+
+WEEK_NS = 7 * 24 * 60 * 60 * 10**9
+
+BASE_SCHEDULE_COLUMNS = [
+    "Key",
+    "DataSource",
+    "TaskDescription",
+    "TaskSequence",
+    "TaskSequence_Weeks",
+    "DeltaWeeks",
+    "HardCapped",
+    "Trade",
+    "Hrs",
+    "Year",
+    "Week",
+    "EstimatedLastServiceDate",
+    "Scheduled_Date",
+    "ScheduledWeek",
+    "TenYearTotal",
+    "TotalCount"
+]
 
 
 class AbstractScheduleAlgorithm:
+    # Whether create_schedule() checks its output with check_valid_schedule() and check_complete_task_list(),
+    # can be turned off for trusted production runs
+    validate = True
+    # Phase timers and counters of create_schedule() (see Instrumentation.Metrics): set it beforehand to collect into
+    # a given Metrics, otherwise one is created on first use and accumulates over the runs of this instance
+    metrics = None
+
     @abstractmethod
     def create_schedule(self, clean_df, wm_df, forecast_years, hardcap):
         pass
 
 
+    def get_metrics(self):
+        if self.metrics is None:
+            self.metrics = Metrics()
+        return self.metrics
+
+
+    @staticmethod
+    def resolve_inputs(clean_df, wm_df):
+        """
+        Function to let create_schedule() take a SharedScheduleInputs bundle in place of clean_df,
+        in which case wm_df defaults to the bundle's weeks master.
+        """
+        if isinstance(clean_df, SharedScheduleInputs):
+            if wm_df is None:
+                wm_df = clean_df.weeks_frame()
+            clean_df = clean_df.task_frame()
+        return clean_df, wm_df
+
+
     @staticmethod
-    def is_constraints_satisfied(constraints: pd.DataFrame, date: str, scheduled_tasks: list[dict], 
-        new_task_hrs: int, hard_capped=False, task_freq=0, add_task=1):
+    def is_constraints_satisfied(constraints, date, scheduled_tasks: list[dict], 
+        new_task_hrs: int, hard_capped=False, task_freq=0, add_task=1, task=None):
         """
         Function to check whether a constraint has been violated.
+
+        constraints is either a ConstraintRegistry bound to the tasks being scheduled (task is then the index of the
+        new task in their TaskStore), a CapacityLedger, which already tracks the hours and tasks placed in each week
+        (scheduled_tasks is then ignored), or the weeks master DataFrame indexed by ScheduledWeek.
         """
-        assert constraints.loc[date].any(), "Date not covered by constraints, please check constraints generation process!"
+        if isinstance(constraints, ConstraintRegistry):
+            week = date if isinstance(date, int) else week_ordinal(date)
+            assert constraints.covers(week), "Date not covered by constraints, please check constraints generation process!"
+            assert not hard_capped, f"Hard cap constraint too strict for task sequence week frequency {task_freq}!"
+            return constraints.can_place(task, week)
+
+        if isinstance(constraints, CapacityLedger):
+            week = date if isinstance(date, int) else week_ordinal(date)
+            assert constraints.covers(week), "Date not covered by constraints, please check constraints generation process!"
+            assert not hard_capped, f"Hard cap constraint too strict for task sequence week frequency {task_freq}!"
+            return constraints.can_place(week, new_task_hrs, add_task)
+
+        week_constraints = constraints.loc[date]
+        assert week_constraints.any(), "Date not covered by constraints, please check constraints generation process!"
         assert not hard_capped, f"Hard cap constraint too strict for task sequence week frequency {task_freq}!"
 
         total_scheduled_hrs = sum([task["Hrs"] for task in scheduled_tasks])
 
         # NOTE: Change this based on how the constraints interface changes
-        if total_scheduled_hrs + new_task_hrs > constraints.loc[date]["AllowedHours"] or \
-            len(scheduled_tasks) + add_task > constraints.loc[date]["AllowedTasks"]:
+        if total_scheduled_hrs + new_task_hrs > week_constraints["AllowedHours"] or \
+            len(scheduled_tasks) + add_task > week_constraints["AllowedTasks"]:
             return False
         else:
             return True
@@ -34,9 +104,19 @@ class AbstractScheduleAlgorithm:
         Function to compute a priority score for ordering tasks.
         A smaller priority score indicates that it is more crucial to be scheduled first.
         """
-        task_sequence_weeks = int(task_entry["TaskSequence_Weeks"])
-        task_hrs = int(task_entry["Hrs"])
-        delta_weeks = int(task_entry["DeltaWeeks"])
+        return AbstractScheduleAlgorithm.priority_score(task_entry["TaskSequence_Weeks"], task_entry["Hrs"],
+                                                        task_entry["DeltaWeeks"], hardcap)
+
+
+    @staticmethod
+    def priority_score(task_sequence_weeks, task_hrs, delta_weeks, hardcap):
+        """
+        Function to compute the priority score of compute_priority_score() from the task's field values, for hot loops
+        that do not keep a record per task.
+        """
+        task_sequence_weeks = int(task_sequence_weeks)
+        task_hrs = int(task_hrs)
+        delta_weeks = int(delta_weeks)
         priority_score = (task_sequence_weeks + 1/task_hrs) / (1 + delta_weeks)
 
         # Force task to be scheduled if delta weeks is hard capped for the task sequence
@@ -58,14 +138,46 @@ class AbstractScheduleAlgorithm:
 
 
     @staticmethod
-    def check_valid_schedule(sched, wm_df, sched_name):
-        weeks_master = wm_df.set_index(["ScheduledWeek"])
+    def check_valid_schedule(sched, wm_df, sched_name, raise_on_violation=True):
+        """
+        Function to check every week of the weeks master against the hours and number of tasks scheduled in it, in one
+        pass: the schedule's hours and tasks are summed per week ordinal with np.bincount.
+
+        Returns a report DataFrame with a row per violating week (ScheduledWeek, ScheduledHours, ScheduledTasks,
+        AllowedHours, AllowedTasks), empty if the schedule is valid. Raises an AssertionError on the first
+        violating week unless raise_on_violation=False.
+        """
+        wm_weeks = week_ordinals(wm_df["ScheduledWeek"])
+        first_week = int(wm_weeks.min()) if len(wm_weeks) else 0
+        size = int(wm_weeks.max()) - first_week + 1 if len(wm_weeks) else 0
 
-        for date in weeks_master.index.values:
-            tasks = sched[sched["ScheduledWeek"] == date].to_dict('records')
-            assert AbstractScheduleAlgorithm.is_constraints_satisfied(weeks_master, date, tasks, 0, add_task=0), \
-                f"Constraint failed for {date} with task_hours {sum([task['Hrs'] for task in tasks])} and number of tasks {len(tasks)}!"
-        print(f"{sched_name} passes constraints!")
+        # Weeks outside the weeks master are not checked
+        positions = week_ordinals(sched["ScheduledWeek"]) - first_week
+        in_range = (positions >= 0) & (positions < size)
+        hrs = sched["Hrs"].to_numpy()
+        scheduled_hours = np.bincount(positions[in_range], weights=hrs[in_range], minlength=size)[wm_weeks - first_week]
+        scheduled_tasks = np.bincount(positions[in_range], minlength=size)[wm_weeks - first_week]
+        if np.issubdtype(hrs.dtype, np.integer):
+            scheduled_hours = scheduled_hours.astype(np.int64)
+
+        report = pd.DataFrame({
+            "ScheduledWeek": wm_df["ScheduledWeek"].to_numpy(),
+            "ScheduledHours": scheduled_hours,
+            "ScheduledTasks": scheduled_tasks,
+            "AllowedHours": wm_df["AllowedHours"].to_numpy(),
+            "AllowedTasks": wm_df["AllowedTasks"].to_numpy(),
+        })
+        report = report.loc[(report["ScheduledHours"] > report["AllowedHours"]) |
+                            (report["ScheduledTasks"] > report["AllowedTasks"])].reset_index(drop=True)
+
+        if not report.empty:
+            assert not raise_on_violation, \
+                f"Constraint failed for {report['ScheduledWeek'].iloc[0]} with task_hours {report['ScheduledHours'].iloc[0]} " \
+                f"and number of tasks {report['ScheduledTasks'].iloc[0]} ({len(report)} weeks failed in total)!"
+            print(f"{sched_name} fails constraints in {len(report)} weeks!")
+        else:
+            print(f"{sched_name} passes constraints!")
+        return report
 
 
     @staticmethod
@@ -78,61 +190,98 @@ class AbstractScheduleAlgorithm:
         print(f"{sched_name} has no missing tasks!")
 
     @staticmethod
-    def build_base_top_down_schedule(clean_df, forecast_years=10):
+    def build_base_top_down_schedule(clean_df, forecast_years=10, chunk_size=None):
         # Currently we go from raw csv -> load_csv() -> clean_dataframe() -> ProcessedData df (tblTasks_London schema)
         # Need to go from ProcessedData df -> build_base_schedule() -> Results df (tblTaskSchedule_London schema)
         # Build base schedule that becomes the object that optimizer iterates on (i.e. iterates b/w blackout and weekly hrs)
 
-        # Current approach limits df obj to <2gb in size, which should be fine????
-        # as long as they don't try to forecast for like 100 years in
-        # TODO: scalability & space complexity would prefer using df.itertuples method to bypass 2gb df memory limit
-        #  but that's a way out there problem and might cost some runtime complexity anyway
         # TODO: df idx column exported under anonymous label, rename to tID and make pKey?
+        chunks = list(AbstractScheduleAlgorithm.iter_base_top_down_schedule(clean_df, forecast_years=forecast_years,
+                                                                            chunk_size=chunk_size))
+        if chunks:
+            schedule_df = pd.concat(chunks, ignore_index=True)
+        else:
+            schedule_df = pd.DataFrame(columns=BASE_SCHEDULE_COLUMNS)
+
+        schedule_df = schedule_df.sort_values(by='Scheduled_Date')
+
+        return schedule_df
+
+
+    @staticmethod
+    def iter_base_top_down_schedule(clean_df, forecast_years=10, chunk_size=None):
+        """
+        Generator that expands every task in clean_df into all of its occurrences before the forecast end date.
+
+        Occurrences are built as columnar arrays (np.repeat of the task rows plus cumulative TaskSequence_Weeks offsets)
+        rather than one dict per occurrence. Rows come out task by task in clean_df order, unsorted.
 
-        schedule_list = []
+        Parameters:
+        - clean_df: pd.DataFrame. Output of clean_dataframe().
+        - forecast_years: int. Default=10. Adjusts the number of years to forecast into the future.
+        - chunk_size: int. Default=None. Maximum number of occurrences per yielded frame, so that memory stays bounded
+          on long horizons. A task with more occurrences than chunk_size is yielded on its own. None yields one frame.
+        """
         forecast_end = pd.Timestamp.today() + pd.DateOffset(years=forecast_years)
+        if clean_df.empty:
+            return
 
-        for task in clean_df.to_dict('records'):
-            tmp = task.copy()
-            tmp['Scheduled_Date'] = tmp.pop('ConsolidatedDates')
-            tmp['TotalCount'] = 0
-            tmp['DeltaWeeks'] = 0
-            tmp['TenYearTotal'] = (52*forecast_years) // tmp['TaskSequence_Weeks']       # iteratively calc for accuracy
-
-            while tmp['Scheduled_Date'] < forecast_end:
-                tmp['Year'] = tmp['Scheduled_Date'].year
-                tmp['Week'] = tmp['Scheduled_Date'].week
-                tmp['ScheduledWeek'] = (tmp['Scheduled_Date'] if (weekday := tmp['Scheduled_Date'].weekday()) == 0
-                                        else tmp['Scheduled_Date'] - pd.DateOffset(days=weekday))
-                tmp['TotalCount'] += 1
-                schedule_list.append(tmp.copy())
-                tmp['Scheduled_Date'] += pd.DateOffset(weeks=tmp['TaskSequence_Weeks'])
-
-        schedule_df = pd.DataFrame.from_records(schedule_list)
-        schedule_df['HardCapped'] = 0
-
-        schedule_df = schedule_df[[
-            "Key",
-            "DataSource",
-            "TaskDescription",
-            "TaskSequence",
-            "TaskSequence_Weeks",
-            "DeltaWeeks",
-            "HardCapped",
-            "Trade",
-            "Hrs",
-            "Year",
-            "Week",
-            "EstimatedLastServiceDate",
-            "Scheduled_Date",
-            "ScheduledWeek",
-            "TenYearTotal",
-            "TotalCount"
-        ]]
+        seq_weeks = clean_df['TaskSequence_Weeks'].to_numpy(dtype=np.int64)
+        assert (seq_weeks > 0).all(), "TaskSequence_Weeks must be a positive number of weeks for every task!"
 
-        schedule_df = schedule_df.sort_values(by='Scheduled_Date')
+        # Work in int64 nanoseconds; pd.DateOffset(weeks=n) is always exactly 7*n days
+        first_dates = clean_df['ConsolidatedDates'].to_numpy(dtype='datetime64[ns]')
+        first_ns = first_dates.view(np.int64)
+        step_ns = seq_weeks * WEEK_NS
+        end_ns = forecast_end.value
 
-        return schedule_df
+        valid = ~np.isnat(first_dates) & (first_ns < end_ns)
+        counts = np.zeros(len(clean_df), dtype=np.int64)
+        counts[valid] = (end_ns - 1 - first_ns[valid]) // step_ns[valid] + 1
+        ten_year_total = (52 * forecast_years) // seq_weeks
+
+        # Split the tasks so that every chunk holds at most chunk_size occurrences
+        if chunk_size is None:
+            bounds = [0, len(clean_df)]
+        else:
+            cum_counts = np.cumsum(counts)
+            bounds = [0]
+            while bounds[-1] < len(clean_df):
+                base = cum_counts[bounds[-1] - 1] if bounds[-1] > 0 else 0
+                stop = np.searchsorted(cum_counts, base + chunk_size, side='right')
+                bounds.append(max(stop, bounds[-1] + 1))
+
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            chunk_counts = counts[lo:hi]
+            total = int(chunk_counts.sum())
+            if total == 0:
+                continue
+
+            task_idx = np.repeat(np.arange(lo, hi), chunk_counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            scheduled_date = pd.DatetimeIndex(first_ns[task_idx] + offsets * step_ns[task_idx])
+            scheduled_week = scheduled_date - pd.to_timedelta(scheduled_date.weekday, unit='D')
+
+            chunk = {}
+            for col in BASE_SCHEDULE_COLUMNS:
+                if col == 'DeltaWeeks' or col == 'HardCapped':
+                    chunk[col] = np.zeros(total, dtype=np.int64)
+                elif col == 'Year':
+                    chunk[col] = scheduled_date.year.to_numpy(dtype=np.int64)
+                elif col == 'Week':
+                    chunk[col] = scheduled_date.isocalendar().week.to_numpy(dtype=np.int64)
+                elif col == 'Scheduled_Date':
+                    chunk[col] = scheduled_date
+                elif col == 'ScheduledWeek':
+                    chunk[col] = scheduled_week
+                elif col == 'TenYearTotal':
+                    chunk[col] = ten_year_total[task_idx]
+                elif col == 'TotalCount':
+                    chunk[col] = offsets + 1
+                else:
+                    chunk[col] = clean_df[col].to_numpy()[task_idx]
+
+            yield pd.DataFrame(chunk, columns=BASE_SCHEDULE_COLUMNS)
 
 
     @staticmethod
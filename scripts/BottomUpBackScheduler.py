@@ -1,11 +1,32 @@
+import numpy as np
 import pandas as pd
 import heapq
-import datetime
 from collections import defaultdict
 from .AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from .Constraints import ConstraintRegistry, WeeklyCapacityConstraint
+from .ScheduleSink import ScheduleSink
+from .TaskStore import TaskStore
+from .PriorityScores import PriorityScoreTable
+from .CapacityLedger import CapacityLedger, week_ordinals, week_ceil, week_starts
+
+
+SCHEDULE_COLUMNS = [
+    "Key", "DataSource", "TaskDescription", "TaskSequence", "TaskSequence_Weeks", "Trade", "Hrs", "Year", "Week",
+    "EstimatedLastServiceDate", "ScheduledWeek", "TotalCount", "DeltaWeeks"
+]
 
 
 class BottomUpBackScheduler(AbstractScheduleAlgorithm):
+    # Whether a conflicting task first looks for free space before its ScheduledWeek, see BottomUpFBScheduler
+    look_back = False
+    # Where to spill placed occurrences to when the schedule is too large to build in memory, see ScheduleSink
+    spill_dir = None
+    spill_rows = 2**20
+    # Constraints checked on top of the weekly capacity of the weeks master (see Constraints), and whether to count
+    # and time the checks per constraint (see ConstraintRegistry.stats(), on self.constraint_registry after a run)
+    constraints = ()
+    profile_constraints = False
+
     def create_schedule(self, clean_df, wm_df, forecast_years, hardcap={}):
         """
         Idea: treat scheduling as a constraint satisfaction problem and use 
@@ -22,92 +43,398 @@ class BottomUpBackScheduler(AbstractScheduleAlgorithm):
 
         Meta Algorithm for backward only:
             1. Extract every task in the dataset and compute an associated priority score
-            2. Create a hash map containing each task and use the task key as an index. Create an empty schedule which will use iso-standard weeks as indices.
-            3. Create a min heap with each task, sorted by the iso-standard week, then priority score, and finally task index.
+            2. Create a task store holding the numeric fields of each task in arrays indexed by task ordinal. Create an empty schedule sink, which records each placed occurrence as typed columns (task ordinal, week ordinal - weeks since an epoch Monday - delta weeks and count).
+            3. Create a min heap with each task, sorted by the week ordinal, then priority score, and finally task index.
             4. While the heap is not empty:
             5.      Extract the task associated with the min of the heap (which will be the task with the earliest week and lowest priority score).
             6.      If this this task can be added to the schedule for the given ScheduledWeek:
-            7.          Insert a copy of the task into the schedule and create the next occurrence of the task, add back to the heap if it occurs within the forecasted end date.
+            7.          Append the occurrence to the schedule sink and create the next occurrence of the task, add back to the heap if it occurs within the forecasted end date.
             8.      else:
             9.          Adjust the ScheduledWeek of the task and increment DeltaWeeks by one.
             10.         Insert the delayed task back into the heap with an updated priority score. 
 
         Parameters:
-        - clean_df: pd.DataFrame. Cleaned input data loaded to Dataframe form.
+        - clean_df: pd.DataFrame or SharedScheduleInputs. Cleaned input data loaded to Dataframe form.
         - weeks_master: dict[start-of-week-date -> int]. Weeks Master data representing the max number of hours allowed per week.
         - forecast_years: int. Default=10. Adjusts the number of years to forecast into the future.
         """
-        weeks_master = wm_df.set_index(["ScheduledWeek"])
+        metrics = self.get_metrics()
+        clean_df, wm_df = AbstractScheduleAlgorithm.resolve_inputs(clean_df, wm_df)
+        ledger = CapacityLedger(wm_df)
+
+        # Weeks are integer week ordinals (see CapacityLedger.week_ordinal) in the heap and the schedule,
+        # and only converted back to Timestamps once the output DataFrame is built.
+        sink = self.make_sink()
+        forecast_end = pd.Timestamp.today() + pd.DateOffset(years=forecast_years)
+        end_week = week_ceil(forecast_end)
+
+        with metrics.phase("build_heap"):
+            tasks = TaskStore.from_frame(clean_df)
+            scores = PriorityScoreTable.for_heap(tasks.seq_weeks, tasks.hrs, hardcap)
+            task_heap = BottomUpBackScheduler.build_task_heap(tasks, hardcap, scores)
+            constraints = self.make_constraints(ledger, clean_df, tasks)
+        with metrics.phase("fill_schedule"):
+            self.fill_schedule(task_heap, tasks, constraints, sink, end_week, hardcap, scores=scores)
+
+        # Convert schedule to dataframe, sorted by ScheduledWeek
+        with metrics.phase("output"):
+            schedule_df = BottomUpBackScheduler.schedule_to_frame(sink, clean_df)
+        if self.validate:
+            with metrics.phase("validation"):
+                AbstractScheduleAlgorithm.check_valid_schedule(schedule_df, wm_df, type(self).__name__)
+                AbstractScheduleAlgorithm.check_complete_task_list(clean_df, schedule_df, type(self).__name__)
+        return schedule_df
+
+    def reschedule(self, prev_schedule, clean_df, wm_df, forecast_years, hardcap={}, added=(), removed=(), modified=()):
+        """
+        Function to update a schedule made by create_schedule() after a change to the task list, without
+        rescheduling every task.
+
+        1. Drop the rows of removed and modified tasks from prev_schedule, freeing their hours and tasks. All other
+           rows stay where they are.
+        2. Place the added and modified tasks (with their new values from clean_df) around the kept rows, with the
+           same heap loop as create_schedule().
+        3. Ripple: every week whose capacity was freed and is still free is offered to kept occurrences that were
+           delayed past it (DeltaWeeks > 0 and first wanted a week no later than it), in the order the heap would
+           have visited them. An occurrence that moves back frees its old week in turn, which is offered the same way.
+
+        The result is a valid schedule, but not necessarily the one create_schedule() would make from scratch: kept
+        occurrences never move later, and only weeks whose capacity changed are revisited.
 
-        schedule = defaultdict(list)
+        Parameters:
+        - prev_schedule: pd.DataFrame. Output of create_schedule() (or reschedule()) for the previous task list.
+        - clean_df: pd.DataFrame or SharedScheduleInputs. The new cleaned input data, holding every task.
+        - wm_df: pd.DataFrame. Weeks master prev_schedule was made with.
+        - forecast_years: int. Number of years to forecast into the future, as for prev_schedule.
+        - added, removed, modified: iterables of task Keys, see diff_task_lists().
+        """
+        assert not self.constraints, "reschedule() only supports the weekly capacity constraints!"
+        clean_df, wm_df = AbstractScheduleAlgorithm.resolve_inputs(clean_df, wm_df)
+        ledger = CapacityLedger(wm_df)
         forecast_end = pd.Timestamp.today() + pd.DateOffset(years=forecast_years)
+        end_week = week_ceil(forecast_end)
+
+        # 1. Keep the rows of unchanged tasks
+        changed_keys = set(removed) | set(modified)
+        dropped = prev_schedule["Key"].isin(changed_keys).to_numpy()
+        kept_df = prev_schedule.loc[~dropped].reset_index(drop=True)
+        weeks = week_ordinals(kept_df["ScheduledWeek"])
+        delta_weeks = kept_df["DeltaWeeks"].to_numpy().copy()
+        hrs = kept_df["Hrs"].tolist()
+        ledger.load(weeks, hrs)
+
+        # 2. Place the new task chains
+        sink = self.make_sink()
+        placed_df = clean_df.loc[clean_df["Key"].isin(set(added) | set(modified))]
+        tasks = TaskStore.from_frame(placed_df)
+        task_heap = BottomUpBackScheduler.build_task_heap(tasks, hardcap)
+        self.fill_schedule(task_heap, tasks, self.make_constraints(ledger, placed_df, tasks), sink, end_week, hardcap)
+
+        # 3. Ripple into freed weeks, earliest first
+        freed_weeks = sorted(set(week_ordinals(prev_schedule.loc[dropped, "ScheduledWeek"]).tolist()))
+        targets = weeks - delta_weeks
+        delayed = np.flatnonzero(delta_weeks > 0)
+        keys = kept_df["Key"].tolist()
+        seq_weeks = kept_df["TaskSequence_Weeks"].tolist()
+        while freed_weeks:
+            week = heapq.heappop(freed_weeks)
+            if freed_weeks and freed_weeks[0] == week:
+                continue
+
+            # Occurrences that wanted this week or an earlier one, but were placed after it
+            candidates = delayed[(targets[delayed] <= week) & (weeks[delayed] > week)]
+            order = []
+            for i in candidates:
+                entry = {"TaskSequence_Weeks": seq_weeks[i], "Hrs": hrs[i], "DeltaWeeks": week - targets[i]}
+                order.append((AbstractScheduleAlgorithm.compute_priority_score(entry, hardcap), keys[i], i))
+
+            for _, _, i in sorted(order):
+                if AbstractScheduleAlgorithm.is_constraints_satisfied(ledger, week, None, hrs[i],
+                                                                      task_freq=seq_weeks[i]):
+                    old_week = int(weeks[i])
+                    ledger.remove(old_week, hrs[i])
+                    ledger.place(week, hrs[i])
+                    weeks[i] = week
+                    delta_weeks[i] = week - targets[i]
+                    heapq.heappush(freed_weeks, old_week)
+
+        kept_df["ScheduledWeek"] = week_starts(weeks)
+        kept_df["DeltaWeeks"] = delta_weeks
+
+        schedule_df = pd.concat([kept_df, BottomUpBackScheduler.schedule_to_frame(sink, placed_df)], ignore_index=True)
+        schedule_df = schedule_df.sort_values(by='ScheduledWeek', kind='stable')
+        if self.validate:
+            AbstractScheduleAlgorithm.check_valid_schedule(schedule_df, wm_df, type(self).__name__)
+            AbstractScheduleAlgorithm.check_complete_task_list(clean_df, schedule_df, type(self).__name__)
+        return schedule_df
+
+    def reschedule_calendar(self, prev_schedule, old_wm_df, new_wm_df, hardcap={}):
+        """
+        Function to update a schedule made by create_schedule() after a change to the weeks master, e.g. a new
+        blackout, without rescheduling every task.
+
+        Only weeks whose AllowedHours or AllowedTasks dropped, and that are now overbooked, are touched: their
+        occurrences are evicted in order of priority (least crucial first, see compute_priority_score()) until the
+        week fits, and then re-placed with the heap loop from their old week, keeping their DeltaWeeks. They follow the
+        same forward (and look back, see BottomUpFBScheduler) shifting rules as create_schedule(), so an evicted
+        occurrence may also go straight back into its old week if it fits once the others are out.
+
+        Parameters:
+        - prev_schedule: pd.DataFrame. Output of create_schedule() made with old_wm_df.
+        - old_wm_df, new_wm_df: pd.DataFrame. Weeks masters before and after the change.
+
+        Returns (schedule_df, report). report lists the moved occurrences with their Key, TotalCount,
+        OldScheduledWeek, new ScheduledWeek and DeltaWeeks.
+        """
+        assert not self.constraints, "reschedule_calendar() only supports the weekly capacity constraints!"
+        ledger = CapacityLedger(new_wm_df)
+        weeks = week_ordinals(prev_schedule["ScheduledWeek"])
+        assert all(ledger.covers(week) for week in set(weeks.tolist())), \
+            "Previous schedule has weeks missing from the new weeks master, please rerun create_schedule()!"
+        ledger.load(weeks, prev_schedule["Hrs"].to_numpy())
+
+        # Weeks that lost hours or tasks
+        capacity = old_wm_df[["ScheduledWeek", "AllowedHours", "AllowedTasks"]].merge(
+            new_wm_df[["ScheduledWeek", "AllowedHours", "AllowedTasks"]], on="ScheduledWeek", suffixes=("Old", ""))
+        dropped = (capacity["AllowedHours"] < capacity["AllowedHoursOld"]) | \
+            (capacity["AllowedTasks"] < capacity["AllowedTasksOld"])
+        overbooked = [week for week in sorted(set(week_ordinals(capacity.loc[dropped, "ScheduledWeek"]).tolist()))
+                      if ledger.is_overbooked(week)]
+
+        # Evict the least crucial occurrences of each overbooked week until it fits
+        positions_by_week = defaultdict(list)
+        for position, week in enumerate(weeks.tolist()):
+            positions_by_week[week].append(position)
+
+        prev_keys = prev_schedule["Key"].tolist()
+        prev_hrs = prev_schedule["Hrs"].tolist()
+        prev_seq_weeks = prev_schedule["TaskSequence_Weeks"].tolist()
+        prev_delta_weeks = prev_schedule["DeltaWeeks"].tolist()
+        prev_total_counts = prev_schedule["TotalCount"].tolist()
+        evicted = []
+        for week in overbooked:
+            occupants = []
+            for position in positions_by_week[week]:
+                priority_score = AbstractScheduleAlgorithm.priority_score(prev_seq_weeks[position], prev_hrs[position],
+                                                                          prev_delta_weeks[position], hardcap)
+                occupants.append((priority_score, position))
+            # Hard capped occurrences (priority score -1) go last
+            occupants.sort(key=lambda occupant: (occupant[0] != -1, occupant[0]), reverse=True)
+
+            while ledger.is_overbooked(week):
+                assert occupants, f"Week {week_starts([week])[0]} cannot fit any tasks!"
+                priority_score, position = occupants.pop(0)
+                ledger.remove(week, prev_hrs[position])
+                evicted.append(position)
+
+        # Occurrences of the same task are told apart by TotalCount
+        task_keys = np.empty(len(evicted), dtype=object)
+        for j, position in enumerate(evicted):
+            task_keys[j] = (prev_keys[position], prev_total_counts[position])
+        tasks = TaskStore(task_keys, evicted,
+                          prev_schedule["Hrs"].to_numpy()[evicted], prev_schedule["TaskSequence_Weeks"].to_numpy()[evicted],
+                          weeks[evicted], prev_schedule["DeltaWeeks"].to_numpy()[evicted],
+                          prev_schedule["TotalCount"].to_numpy()[evicted])
+        task_heap = BottomUpBackScheduler.build_task_heap(tasks, hardcap)
+
+        sink = self.make_sink()
+        constraints = self.make_constraints(ledger, prev_schedule, tasks)
+        self.fill_schedule(task_heap, tasks, constraints, sink, None, hardcap, repeat=False)
+        replaced_df = BottomUpBackScheduler.schedule_to_frame(sink, prev_schedule)
+
+        is_evicted = np.zeros(len(prev_schedule), dtype=bool)
+        is_evicted[evicted] = True
+        schedule_df = pd.concat([prev_schedule.loc[~is_evicted], replaced_df], ignore_index=True)
+        schedule_df = schedule_df.sort_values(by='ScheduledWeek', kind='stable')
+        if self.validate:
+            AbstractScheduleAlgorithm.check_valid_schedule(schedule_df, new_wm_df, type(self).__name__)
 
-        # Setup heap and map to tasks
+        report = replaced_df[["Key", "TotalCount"]].copy()
+        old_weeks = dict(zip(task_keys, weeks[evicted].tolist()))
+        report["OldScheduledWeek"] = week_starts([old_weeks[task_key] for task_key in
+                                                  zip(report["Key"], report["TotalCount"])])
+        report["ScheduledWeek"] = replaced_df["ScheduledWeek"]
+        report["DeltaWeeks"] = replaced_df["DeltaWeeks"]
+        report = report.loc[report["ScheduledWeek"] != report["OldScheduledWeek"]].sort_values(by=["Key", "TotalCount"])
+        return schedule_df, report
+
+    @staticmethod
+    def diff_task_lists(old_clean_df, new_clean_df):
+        """
+        Function to compare two cleaned task lists by Key, for reschedule().
+
+        Returns (added, removed, modified) lists of Keys: tasks only in new_clean_df, tasks only in old_clean_df, and
+        tasks in both with a different value in any column they share.
+        """
+        old_df = old_clean_df.set_index("Key")
+        new_df = new_clean_df.set_index("Key")
+        added = new_df.index.difference(old_df.index, sort=False).tolist()
+        removed = old_df.index.difference(new_df.index, sort=False).tolist()
+
+        common_keys = new_df.index.intersection(old_df.index, sort=False)
+        common_cols = new_df.columns.intersection(old_df.columns, sort=False)
+        old_values = old_df.loc[common_keys, common_cols]
+        new_values = new_df.loc[common_keys, common_cols]
+        changed = ~((old_values == new_values) | (old_values.isna() & new_values.isna()))
+        modified = common_keys[changed.any(axis=1).to_numpy()].tolist()
+        return added, removed, modified
+
+    @staticmethod
+    def build_task_heap(tasks, hardcap, scores=None):
+        """
+        Function to build the min heap of the next occurrence of every task in a TaskStore, for fill_schedule().
+        Heap entries are [week ordinal, priority score, task Key, task store index]. scores is the
+        PriorityScoreTable.for_heap() of tasks, built if not given.
+        """
+        if scores is None:
+            scores = PriorityScoreTable.for_heap(tasks.seq_weeks, tasks.hrs, hardcap)
         task_heap = []
-        task_map = dict()
-        for task in clean_df.to_dict('records'):
-            tmp = task.copy()
-            tmp['ScheduledWeek'] = tmp.pop('ConsolidatedDates')
-            tmp['ScheduledWeek'] = tmp['ScheduledWeek'] - pd.DateOffset(days=tmp['ScheduledWeek'].weekday())
-            tmp['TotalCount'] = 0
-            tmp['DeltaWeeks'] = 0
-            priority_score = AbstractScheduleAlgorithm.compute_priority_score(tmp, hardcap)
-            iso_week = AbstractScheduleAlgorithm.convert_date_to_iso(tmp['ScheduledWeek'])
-            key = tmp["Key"]
-
-            heapq.heappush(task_heap, [iso_week, priority_score, key])
-            task_map[key] = tmp
-        
+        for i, (week, delta, key) in enumerate(zip(tasks.weeks.tolist(), tasks.delta_weeks.tolist(),
+                                                   tasks.keys.tolist())):
+            row = scores.task_rows[i]
+            priority_score = row[delta] if 0 <= delta < len(row) else scores.score(i, delta)
+            task_heap.append([week, priority_score, key, i])
+        heapq.heapify(task_heap)
+        return task_heap
+
+    def fill_schedule(self, task_heap, tasks, constraints, sink, end_week, hardcap, repeat=True, scores=None):
+        """
+        Function to run the heap loop (steps 4-10 above) until task_heap is empty, appending the placed occurrences
+        to sink (see make_sink()) and to constraints (see make_constraints()), and updating tasks (a TaskStore) to the
+        state after the last of them.
+
+        With repeat=False the heap holds single occurrences (e.g. evicted by reschedule_calendar()), which keep their
+        TotalCount and are not followed by a next occurrence.
+
+        Priority scores are read from scores, the PriorityScoreTable.for_heap() of tasks (built if not given).
+
+        The loop's event counts (heap pops, constraint checks, placements and shifts) are added to self.get_metrics()
+        once it ends. Hard cap hits are not counted: an occurrence reaching its hard cap fails the run.
+        """
+        if scores is None:
+            scores = PriorityScoreTable.for_heap(tasks.seq_weeks, tasks.hrs, hardcap)
+        task_scores = scores.task_rows
+        # NOTE: the task fields are copied to Python lists for the loop, scalar indexing into lists is several times
+        # faster than into np.ndarrays
+        keys = tasks.keys.tolist()
+        task_ordinals = tasks.task_ordinals.tolist()
+        hrs = tasks.hrs.tolist()
+        seq_weeks = tasks.seq_weeks.tolist()
+        weeks = tasks.weeks.tolist()
+        delta_weeks = tasks.delta_weeks.tolist()
+        total_counts = tasks.total_counts.tolist()
+        heap_pops = constraint_checks = forward_shifts = back_shifts = 0
+
+        def add_to_schedule(i, week, placed_week):
+            # Add the task to the schedule
+            if repeat:
+                total_counts[i] += 1
+            weeks[i] = placed_week
+            sink.append(task_ordinals[i], placed_week, delta_weeks[i], total_counts[i])
+            constraints.place(i, placed_week)
+            if not repeat:
+                return
+
+            # Compute next scheduled week, where the delta weeks shift is reset
+            next_week = week + seq_weeks[i] - delta_weeks[i]
+
+            # Insert task back into heap if there are still more occurences
+            if next_week < end_week:
+                weeks[i] = next_week
+                delta_weeks[i] = 0
+
+                heapq.heappush(task_heap, [next_week, task_scores[i][0], keys[i], i])
+
         # Generate schedule
         while task_heap:
-            date_index, priority_score, key = heapq.heappop(task_heap)
-            new_task = task_map[key]
+            week, priority_score, key, i = heapq.heappop(task_heap)
+            heap_pops += 1
 
             # Need to make sure new task does not violate constraints
-            if AbstractScheduleAlgorithm.is_constraints_satisfied(weeks_master, date_index, schedule[date_index], 
-                new_task["Hrs"], hard_capped=bool(priority_score==-1), task_freq=new_task["TaskSequence_Weeks"]):
-                # Add the task to the schedule
-                new_task["TotalCount"] += 1
-                schedule[date_index].append(new_task.copy())
-
-                # Compute next scheduled time, where the delta weeks shift is reset
-                next_date = datetime.datetime.strptime(date_index, "%Y-%m-%d") \
-                    + pd.DateOffset(weeks=new_task["TaskSequence_Weeks"]) \
-                    - pd.DateOffset(weeks=new_task["DeltaWeeks"])
-
-                # Insert task back into heap if there are still more occurences
-                if next_date < forecast_end:
-                    new_task["ScheduledWeek"] = next_date
-                    new_task['DeltaWeeks'] = 0
-
-                    priority_score = AbstractScheduleAlgorithm.compute_priority_score(new_task, hardcap)
-                    iso_week = AbstractScheduleAlgorithm.convert_date_to_iso(new_task["ScheduledWeek"])
-                    key = new_task["Key"]
-
-                    heapq.heappush(task_heap, [iso_week, priority_score, key])
-                        
+            constraint_checks += 1
+            if AbstractScheduleAlgorithm.is_constraints_satisfied(constraints, week, None, 
+                hrs[i], hard_capped=bool(priority_score==-1), task_freq=seq_weeks[i], task=i):
+                add_to_schedule(i, week, week)
+                continue
+
             # Move task if constraints are violated 
-            else: # Look forward: increment ScheduledWeek by one week
-                new_date = datetime.datetime.strptime(date_index, "%Y-%m-%d") + pd.DateOffset(weeks=1)
-                new_task["ScheduledWeek"] = new_date
-                new_task["DeltaWeeks"] += 1
-                
-                # Recompute priority score with delta weeks adjusted and re-insert into heap
-                priority_score = AbstractScheduleAlgorithm.compute_priority_score(new_task, hardcap)
-                iso_week = AbstractScheduleAlgorithm.convert_date_to_iso(new_task["ScheduledWeek"])
-                key = new_task["Key"]
-
-                heapq.heappush(task_heap, [iso_week, priority_score, key])
-
-        # Convert schedule to dataframe
-        schedule_list = [task for task_list in schedule.values() for task in task_list]
-        schedule_df = pd.DataFrame.from_records(schedule_list)
-
-        schedule_df = schedule_df[[
-            "Key", "DataSource", "TaskDescription", "TaskSequence", "TaskSequence_Weeks", "Trade", "Hrs", "Year", "Week",
-            "EstimatedLastServiceDate", "ScheduledWeek", "TotalCount", "DeltaWeeks"
-        ]]
-        schedule_df = schedule_df.sort_values(by='ScheduledWeek')
-        AbstractScheduleAlgorithm.check_valid_schedule(schedule_df, wm_df, type(self).__name__)
-        AbstractScheduleAlgorithm.check_complete_task_list(clean_df, schedule_df, type(self).__name__)
+            if self.look_back: # Look backward: place the task if there is a free space.
+                # Check the week that is $DeltaWeeks + 1 backward from the original week
+                # E.g. when the task conflicts for the first time, $DeltaWeeks = 0 therefore we check -1 week from the original week, etc.
+                # NOTE: the check below is against the conflicting week rather than past_week, as it always has been
+                past_week = week - (2*delta_weeks[i] + 1)
+                constraint_checks += 1
+                if AbstractScheduleAlgorithm.is_constraints_satisfied(constraints, week, None, 
+                    hrs[i], hard_capped=bool(priority_score==-1), task_freq=seq_weeks[i], task=i):
+                    delta_weeks[i] = -(delta_weeks[i] + 1)
+                    add_to_schedule(i, week, past_week)
+                    back_shifts += 1
+                    continue
+
+            # Look forward: increment ScheduledWeek by one week
+            forward_shifts += 1
+            weeks[i] = week + 1
+            delta_weeks[i] += 1
+            
+            # Recompute priority score with delta weeks adjusted and re-insert into heap
+            delta = delta_weeks[i]
+            row = task_scores[i]
+            priority_score = row[delta] if 0 <= delta < len(row) else scores.score(i, delta)
+            heapq.heappush(task_heap, [week + 1, priority_score, key, i])
+
+        tasks.weeks[:] = weeks
+        tasks.delta_weeks[:] = delta_weeks
+        tasks.total_counts[:] = total_counts
+        self.get_metrics().add_counts(heap_pops=heap_pops, constraint_checks=constraint_checks,
+                                      placements=heap_pops - forward_shifts, forward_shifts=forward_shifts,
+                                      back_shifts=back_shifts)
+
+    def make_constraints(self, ledger, task_df, tasks):
+        """
+        Function to build the ConstraintRegistry fill_schedule() checks: the weekly capacity tracked by ledger, then
+        self.constraints, bound to tasks (a TaskStore over the rows of task_df).
+        """
+        registry = ConstraintRegistry([WeeklyCapacityConstraint(ledger), *self.constraints],
+                                      profile=self.profile_constraints)
+        self.constraint_registry = registry
+        return registry.bind(task_df, tasks)
+
+    def make_sink(self):
+        """
+        Function to create the ScheduleSink fill_schedule() appends placed occurrences to: the task ordinal (row of
+        the task in the frame its heap was built from), week ordinal, DeltaWeeks and TotalCount of each.
+        """
+        return ScheduleSink({"TaskOrdinal": np.int64, "ScheduledWeek": np.int64, "DeltaWeeks": np.int64,
+                             "TotalCount": np.int64}, spill_dir=self.spill_dir, spill_rows=self.spill_rows)
+
+    @staticmethod
+    def schedule_to_frame(sink, task_df):
+        """
+        Function to convert the occurrences in sink to the output DataFrame, stably sorted by ScheduledWeek. The task
+        columns are taken from the rows of task_df given by the task ordinals.
+        """
+        columns = sink.columns(sort_by="ScheduledWeek")
+        sink.close()
+        task_ordinals = columns["TaskOrdinal"]
+
+        schedule_df = pd.DataFrame(index=pd.RangeIndex(len(task_ordinals)))
+        for col in SCHEDULE_COLUMNS:
+            if col == "ScheduledWeek":
+                schedule_df[col] = week_starts(columns[col])
+            elif col in columns:
+                schedule_df[col] = columns[col]
+            else:
+                schedule_df[col] = _record_values(task_df[col].to_numpy()[task_ordinals])
         return schedule_df
+
+
+def _record_values(values):
+    # Same dtypes as building the frame from task record dicts: integers and floats widen to 64 bit, and object
+    # columns of Python scalars (e.g. from the nullable UInt32 Year and Week) are inferred again
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64)
+    if values.dtype.kind == 'f':
+        return values.astype(np.float64)
+    if values.dtype == object:
+        return pd.Series(values, dtype=object).infer_objects().to_numpy()
+    return values
@@ -0,0 +1,153 @@
+import datetime
+import numpy as np
+import pandas as pd
+
+
+# Weeks are represented internally as the number of whole weeks since this Monday.
+EPOCH_MONDAY = datetime.date(1970, 1, 5)
+_EPOCH_ORDINAL = EPOCH_MONDAY.toordinal()
+_EPOCH_DAY = np.datetime64(EPOCH_MONDAY, 'D').astype(np.int64)
+
+
+def week_ordinal(date):
+    """
+    Function to map a date (ISO "%Y-%m-%d" string, datetime.date/datetime or pd.Timestamp) to its week ordinal,
+    i.e. the number of weeks between EPOCH_MONDAY and the Monday starting the date's ISO 8601 week.
+    """
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date[:10])
+    elif isinstance(date, np.datetime64):
+        date = pd.Timestamp(date)
+    return (date.toordinal() - _EPOCH_ORDINAL) // 7
+
+
+def week_ordinals(dates):
+    """
+    Vectorized week_ordinal for an array-like or Series of datetimes. Returns an int64 np.ndarray.
+    """
+    days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+    return (days - _EPOCH_DAY) // 7
+
+
+def week_start(week):
+    """
+    Function to map a week ordinal back to the pd.Timestamp of the Monday starting that week.
+    """
+    return pd.Timestamp(EPOCH_MONDAY) + pd.Timedelta(weeks=week)
+
+
+def week_starts(weeks):
+    """
+    Vectorized week_start for an array-like of week ordinals. Returns a datetime64[ns] np.ndarray.
+    """
+    days = np.asarray(weeks, dtype=np.int64) * 7 + _EPOCH_DAY
+    return days.astype('datetime64[D]').astype('datetime64[ns]')
+
+
+def week_ceil(date):
+    """
+    Function to get the first week ordinal whose Monday is not before date,
+    i.e. week_start(week) < date if and only if week < week_ceil(date).
+    """
+    week = week_ordinal(date)
+    if week_start(week) < date:
+        week += 1
+    return week
+
+
+class CapacityLedger:
+    """
+    Compact per-week capacity ledger built from the weeks master.
+
+    Weeks are indexed by week ordinal, offset so the first week of the weeks master is position 0. Allowed and used
+    hours/tasks are kept in flat arrays and updated incrementally with place() and remove(), so checking whether a
+    task fits in a week is O(1) instead of a DataFrame label lookup plus a sum over the week's tasks.
+    """
+    def __init__(self, wm_df, extra_weeks=None):
+        """
+        Parameters:
+        - wm_df: pd.DataFrame. Weeks master with ScheduledWeek, AllowedHours and AllowedTasks columns.
+        - extra_weeks: array-like of week ordinals. Default=None. Weeks missing from the weeks master that should still
+          be covered by the ledger, with no allowed hours or tasks (e.g. weeks a schedule spills into).
+        """
+        weeks = week_ordinals(wm_df["ScheduledWeek"])
+        all_weeks = weeks if extra_weeks is None else np.concatenate([weeks, np.asarray(extra_weeks, dtype=np.int64)])
+        self.first_week = int(all_weeks.min()) if len(all_weeks) else 0
+        size = int(all_weeks.max()) - self.first_week + 1 if len(all_weeks) else 0
+        positions = weeks - self.first_week
+
+        covered = np.zeros(size, dtype=bool)
+        allowed_hours = np.zeros(size, dtype=wm_df["AllowedHours"].dtype)
+        allowed_tasks = np.zeros(size, dtype=wm_df["AllowedTasks"].dtype)
+        covered[all_weeks - self.first_week] = True
+        allowed_hours[positions] = wm_df["AllowedHours"].to_numpy()
+        allowed_tasks[positions] = wm_df["AllowedTasks"].to_numpy()
+
+        # NOTE: Python lists rather than np.ndarrays, scalar indexing into lists is several times faster
+        self.covered = covered.tolist()
+        self.allowed_hours = allowed_hours.tolist()
+        self.allowed_tasks = allowed_tasks.tolist()
+        self.used_hours = [0] * size
+        self.used_tasks = [0] * size
+
+    def __len__(self):
+        return len(self.covered)
+
+    def covers(self, week):
+        i = week - self.first_week
+        return 0 <= i < len(self.covered) and self.covered[i]
+
+    def uncover(self, week):
+        self.covered[week - self.first_week] = False
+
+    def can_place(self, week, hrs, num_tasks=1):
+        i = week - self.first_week
+        return not (self.used_hours[i] + hrs > self.allowed_hours[i] or
+                    self.used_tasks[i] + num_tasks > self.allowed_tasks[i])
+
+    def place(self, week, hrs, num_tasks=1):
+        i = week - self.first_week
+        self.used_hours[i] += hrs
+        self.used_tasks[i] += num_tasks
+
+    def load(self, weeks, hrs):
+        """
+        Function to place many tasks at once, e.g. an existing schedule. weeks are week ordinals and hrs the hours of
+        each task; both array-like of the same length.
+        """
+        positions = np.asarray(weeks, dtype=np.int64) - self.first_week
+        hrs = np.asarray(hrs)
+        added_hours = np.bincount(positions, weights=hrs, minlength=len(self))
+        if np.issubdtype(hrs.dtype, np.integer):
+            added_hours = added_hours.astype(np.int64)
+        added_tasks = np.bincount(positions, minlength=len(self))
+
+        self.used_hours = (np.asarray(self.used_hours) + added_hours).tolist()
+        self.used_tasks = (np.asarray(self.used_tasks) + added_tasks).tolist()
+
+    def remove(self, week, hrs, num_tasks=1):
+        i = week - self.first_week
+        self.used_hours[i] -= hrs
+        self.used_tasks[i] -= num_tasks
+
+    def is_overbooked(self, week):
+        i = week - self.first_week
+        return self.used_hours[i] > self.allowed_hours[i] or self.used_tasks[i] > self.allowed_tasks[i]
+
+    def overbooked_weeks(self):
+        """
+        Function to list the week ordinals (ascending) whose used hours or tasks exceed what is allowed.
+        """
+        return [i + self.first_week for i in range(len(self)) if self.covered[i] and self.is_overbooked(i + self.first_week)]
+
+    def remaining_hours(self, week):
+        if not self.covers(week):
+            raise KeyError(week)
+        i = week - self.first_week
+        return self.allowed_hours[i] - self.used_hours[i]
+
+    def remaining_tasks(self, week):
+        if not self.covers(week):
+            raise KeyError(week)
+        i = week - self.first_week
+        return self.allowed_tasks[i] - self.used_tasks[i]
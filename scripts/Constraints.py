@@ -0,0 +1,245 @@
+import time
+import pandas as pd
+from collections import defaultdict
+
+
+class Constraint:
+    """
+    Base class of the scheduling constraints evaluated by the heap schedulers through a ConstraintRegistry.
+
+    A constraint keeps its own incremental state of what has been placed, so that can_place(), place() and unplace()
+    are O(1). Tasks are referred to by their index i in the TaskStore being scheduled and weeks by week ordinal.
+    bind() is called once before scheduling: it resets the state and precomputes whatever per-task values the checks
+    need (e.g. trade codes) from the task frame, so the checks never touch a DataFrame.
+    """
+    name = "Constraint"
+
+    def bind(self, task_df, tasks):
+        """
+        task_df: pd.DataFrame the tasks come from, tasks: TaskStore whose task_ordinals are rows of task_df.
+        """
+        pass
+
+    def covers(self, week):
+        return True
+
+    def can_place(self, i, week):
+        return True
+
+    def place(self, i, week):
+        pass
+
+    def unplace(self, i, week):
+        pass
+
+
+class WeeklyCapacityConstraint(Constraint):
+    """
+    AllowedHours and AllowedTasks of every week in the weeks master, backed by a CapacityLedger.
+    """
+    name = "WeeklyCapacity"
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+
+    def bind(self, task_df, tasks):
+        self.hrs = tasks.hrs.tolist()
+
+    def covers(self, week):
+        return self.ledger.covers(week)
+
+    def can_place(self, i, week):
+        return self.ledger.can_place(week, self.hrs[i])
+
+    def place(self, i, week):
+        self.ledger.place(week, self.hrs[i])
+
+    def unplace(self, i, week):
+        self.ledger.remove(week, self.hrs[i])
+
+
+class TradeHoursConstraint(Constraint):
+    """
+    Maximum number of hours per week for each Trade.
+
+    limits: dict[trade -> hours]. Trades missing from limits are not limited.
+    """
+    name = "TradeHours"
+
+    def __init__(self, limits):
+        self.limits = limits
+
+    def bind(self, task_df, tasks):
+        trades = task_df["Trade"].to_numpy()[tasks.task_ordinals]
+        self.task_limits = [self.limits.get(trade) for trade in trades]
+        self.task_trades = trades.tolist()
+        self.hrs = tasks.hrs.tolist()
+        self.used_hours = defaultdict(int)
+
+    def can_place(self, i, week):
+        limit = self.task_limits[i]
+        return limit is None or self.used_hours[(self.task_trades[i], week)] + self.hrs[i] <= limit
+
+    def place(self, i, week):
+        self.used_hours[(self.task_trades[i], week)] += self.hrs[i]
+
+    def unplace(self, i, week):
+        self.used_hours[(self.task_trades[i], week)] -= self.hrs[i]
+
+
+class ConcurrentTasksConstraint(Constraint):
+    """
+    Maximum number of tasks per week on the same asset.
+
+    max_tasks: int. column: str. Default="DataSource". Column of the task frame identifying the asset.
+    """
+    name = "ConcurrentTasks"
+
+    def __init__(self, max_tasks, column="DataSource"):
+        self.max_tasks = max_tasks
+        self.column = column
+
+    def bind(self, task_df, tasks):
+        self.task_assets = task_df[self.column].to_numpy()[tasks.task_ordinals].tolist()
+        self.used_tasks = defaultdict(int)
+
+    def can_place(self, i, week):
+        return self.used_tasks[(self.task_assets[i], week)] < self.max_tasks
+
+    def place(self, i, week):
+        self.used_tasks[(self.task_assets[i], week)] += 1
+
+    def unplace(self, i, week):
+        self.used_tasks[(self.task_assets[i], week)] -= 1
+
+
+class MinSpacingConstraint(Constraint):
+    """
+    Minimum number of weeks between an occurrence of a task and its previously placed occurrence.
+
+    min_weeks: int, or dict[TaskSequence_Weeks -> int] to only space out tasks of the given frequencies.
+
+    The placed weeks of each task are a dict of week -> number of occurrences placed in it, ordered by when each week
+    was last placed, so the previously placed occurrence is the last key and unplace() is O(1) as well.
+    """
+    name = "MinSpacing"
+
+    def __init__(self, min_weeks):
+        self.min_weeks = min_weeks
+
+    def bind(self, task_df, tasks):
+        if isinstance(self.min_weeks, dict):
+            self.task_min_weeks = [self.min_weeks.get(seq_weeks, 0) for seq_weeks in tasks.seq_weeks.tolist()]
+        else:
+            self.task_min_weeks = [self.min_weeks] * len(tasks)
+        self.placed_weeks = defaultdict(dict)
+
+    def can_place(self, i, week):
+        placed_weeks = self.placed_weeks[i]
+        return not placed_weeks or abs(week - next(reversed(placed_weeks))) >= self.task_min_weeks[i]
+
+    def place(self, i, week):
+        # Move the week to the end, it is now the last placed
+        placed_weeks = self.placed_weeks[i]
+        placed_weeks[week] = placed_weeks.pop(week, 0) + 1
+
+    def unplace(self, i, week):
+        placed_weeks = self.placed_weeks[i]
+        count = placed_weeks[week] - 1
+        if count:
+            placed_weeks[week] = count
+        else:
+            del placed_weeks[week]
+
+
+class ConstraintRegistry:
+    """
+    Set of constraints evaluated together: an occurrence can be placed in a week if every constraint allows it.
+
+    bind() precompiles can_place()/place()/unplace() into plain functions over the constraints' bound methods (a single
+    constraint is called directly). With profile=True every call is counted and timed per constraint instead, see
+    stats().
+    """
+    def __init__(self, constraints, profile=False):
+        self.constraints = list(constraints)
+        self.profile = profile
+        self.checks = [0] * len(self.constraints)
+        self.rejections = [0] * len(self.constraints)
+        self.seconds = [0.0] * len(self.constraints)
+
+    def bind(self, task_df, tasks):
+        for constraint in self.constraints:
+            constraint.bind(task_df, tasks)
+
+        covers = [constraint.covers for constraint in self.constraints if type(constraint).covers is not Constraint.covers]
+        self.covers = covers[0] if len(covers) == 1 else lambda week: all(check(week) for check in covers)
+
+        if self.profile:
+            self.can_place, self.place, self.unplace = self._profiled()
+        elif len(self.constraints) == 1:
+            self.can_place = self.constraints[0].can_place
+            self.place = self.constraints[0].place
+            self.unplace = self.constraints[0].unplace
+        else:
+            checks = [constraint.can_place for constraint in self.constraints]
+            places = [constraint.place for constraint in self.constraints]
+            unplaces = [constraint.unplace for constraint in self.constraints]
+
+            def can_place(i, week):
+                for check in checks:
+                    if not check(i, week):
+                        return False
+                return True
+
+            def place(i, week):
+                for update in places:
+                    update(i, week)
+
+            def unplace(i, week):
+                for update in unplaces:
+                    update(i, week)
+
+            self.can_place, self.place, self.unplace = can_place, place, unplace
+        return self
+
+    def _profiled(self):
+        perf_counter = time.perf_counter
+        checks, rejections, seconds = self.checks, self.rejections, self.seconds
+        constraints = list(enumerate(self.constraints))
+
+        def can_place(i, week):
+            for j, constraint in constraints:
+                start = perf_counter()
+                allowed = constraint.can_place(i, week)
+                seconds[j] += perf_counter() - start
+                checks[j] += 1
+                if not allowed:
+                    rejections[j] += 1
+                    return False
+            return True
+
+        def place(i, week):
+            for j, constraint in constraints:
+                start = perf_counter()
+                constraint.place(i, week)
+                seconds[j] += perf_counter() - start
+
+        def unplace(i, week):
+            for j, constraint in constraints:
+                start = perf_counter()
+                constraint.unplace(i, week)
+                seconds[j] += perf_counter() - start
+
+        return can_place, place, unplace
+
+    def stats(self):
+        """
+        Function to get a DataFrame of the number of checks, rejections and seconds spent (checks and updates) per
+        constraint. Only collected with profile=True.
+        """
+        return pd.DataFrame({
+            "Constraint": [constraint.name for constraint in self.constraints],
+            "Checks": self.checks,
+            "Rejections": self.rejections,
+            "Seconds": self.seconds,
+        })
@@ -0,0 +1,101 @@
+import os
+import hashlib
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class FrameCache:
+    """
+    Content-addressed on-disk cache of DataFrames.
+
+    Entries are stored as one file per key in cache_dir: parquet when pyarrow is installed, a pickle otherwise. Reading
+    an entry touches its modification time, and writing one evicts the least recently used entries until the cache
+    fits in max_bytes again.
+
+    Keys are built with FrameCache.key() from everything the cached frame depends on, e.g. parameters and the contents
+    of input files (see file_digest()), so a changed input simply misses the cache instead of returning stale data.
+    """
+    def __init__(self, cache_dir, max_bytes=256 * 2**20):
+        """
+        Parameters:
+        - cache_dir: str. Directory holding the cache entries, created if missing.
+        - max_bytes: int. Default=256 MiB. Size cap of all entries together.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.extension = ".parquet" if pyarrow is not None else ".pkl"
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """
+        Function to hash the given parts (bytes, or anything with a stable repr) into a cache key.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, bytes) else repr(part).encode("utf-8")
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def file_digest(filepath):
+        """
+        Function to hash the contents of a file, for use as a part of a cache key. Returns None if there is no file.
+        """
+        if filepath is None or filepath == '' or not os.path.exists(filepath):
+            return None
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + self.extension)
+
+    def get(self, key):
+        """
+        Function to read the frame cached under key, or None if there is no such entry.
+        """
+        path = self.path(key)
+        try:
+            df = pd.read_parquet(path) if self.extension == ".parquet" else pd.read_pickle(path)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return df
+
+    def put(self, key, df):
+        """
+        Function to cache df under key, then evict least recently used entries down to max_bytes.
+        """
+        path = self.path(key)
+        # Write to a temporary file first so that readers never see a partial entry
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        if self.extension == ".parquet":
+            df.to_parquet(temp_path, index=False)
+        else:
+            df.to_pickle(temp_path)
+        os.replace(temp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.extension):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.cache_dir, name)))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
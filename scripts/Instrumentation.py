@@ -0,0 +1,88 @@
+import io
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Metrics:
+    """
+    Phase timers and event counters of a scheduling run.
+
+    Phases are timed with the phase() context manager, which accumulates seconds and calls per phase name (nested
+    phases are each timed in full). Counters are plain integers added with count(); hot loops keep local counters and
+    add them once at the end, so instrumentation costs nothing per iteration beyond an integer increment.
+
+    With profile=True and/or trace_memory=True, capture() also runs cProfile and/or tracemalloc around its block and
+    adds the top functions by cumulative time and the peak traced memory to the metrics.
+    """
+    def __init__(self, profile=False, trace_memory=False, profile_lines=30):
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profile_lines = profile_lines
+        self.timers = {}
+        self.counters = {}
+        self.profile_stats = None
+        self.peak_memory_mb = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timer = self.timers.setdefault(name, {"seconds": 0.0, "calls": 0})
+            timer["seconds"] += time.perf_counter() - start
+            timer["calls"] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_counts(self, **counts):
+        for name, n in counts.items():
+            self.count(name, n)
+
+    @contextmanager
+    def capture(self):
+        """
+        Context manager running cProfile and/or tracemalloc around its block, if enabled.
+        """
+        profiler = cProfile.Profile() if self.profile else None
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield self
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(self.profile_lines)
+                self.profile_stats = stream.getvalue()
+            if self.trace_memory:
+                self.peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            if started_tracing:
+                tracemalloc.stop()
+
+    def as_dict(self):
+        metrics = {"phases": {name: dict(timer) for name, timer in self.timers.items()},
+                   "counters": dict(self.counters)}
+        if self.peak_memory_mb is not None:
+            metrics["peak_memory_mb"] = self.peak_memory_mb
+        if self.profile_stats is not None:
+            metrics["profile"] = self.profile_stats
+        return metrics
+
+    def to_json(self, path=None, indent=2):
+        """
+        Function to dump the metrics as JSON, to path if given. Returns the JSON string.
+        """
+        text = json.dumps(self.as_dict(), indent=indent)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
@@ -0,0 +1,206 @@
+import time
+import random
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from .AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from .CapacityLedger import CapacityLedger, week_ordinals, week_starts
+
+
+class LocalSearch:
+    """
+    Anytime improvement pass over a valid schedule from any of the schedulers.
+
+    Occurrences are moved between weeks with two kinds of moves, both under the AllowedHours and AllowedTasks of the
+    weeks master:
+    - shift: move one occurrence to another week, either closer to its original week (ScheduledWeek - DeltaWeeks) or
+      anywhere within its hard cap (max_shift weeks for frequencies without one),
+    - swap: exchange the weeks of two occurrences, when the target week has no room for a shift.
+
+    A move is kept if it lowers the total |DeltaWeeks|, or with balance=True if it keeps it and lowers the sum over
+    weeks of the squared scheduled hours, which evens out the load between weeks. Moves are evaluated from the week totals of a
+    CapacityLedger and the two or three numbers that change, so each costs O(1) whatever the size of the schedule.
+
+    As in AbstractScheduleAlgorithm.check_valid_schedule(), weeks missing from the weeks master (e.g. top-down tasks
+    pushed past its end) are not checked: their occurrences are frozen, never moved nor moved into.
+
+    As only improving moves are kept, the current schedule is always the best found so far and always valid. The
+    search stops after seconds, after patience moves in a row without an improvement, or on KeyboardInterrupt (a move
+    interrupted half way is rolled back), and improve() returns the schedule as it is at that point.
+    """
+    def __init__(self, seconds=10.0, max_shift=4, balance=True, patience=10**6, seed=0, metrics=None):
+        """
+        Parameters:
+        - seconds: float. Default=10.0. Wall-clock budget of improve().
+        - max_shift: int. Default=4. Maximum |DeltaWeeks| of occurrences of frequencies without a hard cap.
+        - balance: bool. Default=True. Whether to also keep moves that even out the weekly hours at the same drift.
+        - patience: int. Default=10**6. Number of moves in a row without an improvement after which to stop.
+        - seed: int. Default=0. Seed of the random choice of moves, so runs are reproducible.
+        - metrics: Instrumentation.Metrics. Default=None. Metrics to add the move counters to.
+        """
+        self.seconds = seconds
+        self.max_shift = max_shift
+        self.balance = balance
+        self.patience = patience
+        self.seed = seed
+        self.metrics = metrics
+
+    def improve(self, sched, wm_df, hardcap={}):
+        """
+        Function to improve sched (output of create_schedule(), valid against wm_df) and return the improved copy,
+        sorted by ScheduledWeek. The columns derived from the week of an occurrence (ScheduledWeek and DeltaWeeks, and
+        for top-down schedules Scheduled_Date, Year, Week, DeltaDays and HardCapped) are updated for moved occurrences.
+        """
+        weeks = week_ordinals(sched["ScheduledWeek"])
+        nominal = (weeks - sched["DeltaWeeks"].to_numpy(dtype=np.int64)).tolist()
+        hrs = sched["Hrs"].tolist()
+        windows = [hardcap.get(freq, self.max_shift) for freq in sched["TaskSequence_Weeks"].tolist()]
+        week = weeks.tolist()
+
+        ledger = CapacityLedger(wm_df)
+        movable = [i for i, w in enumerate(week) if ledger.covers(w)]
+        ledger.load(weeks[movable], np.asarray(hrs)[movable])
+        assert not ledger.overbooked_weeks(), "LocalSearch needs a valid schedule to start from!"
+        used_hours = ledger.used_hours
+
+        # Occurrences of every week, and the drifted occurrences, as lists with positions for O(1) removal
+        members = defaultdict(list)
+        member_pos = [0] * len(week)
+        drifted, drifted_pos = [], [-1] * len(week)
+        for i in movable:
+            w = week[i]
+            member_pos[i] = len(members[w])
+            members[w].append(i)
+            if w != nominal[i]:
+                drifted_pos[i] = len(drifted)
+                drifted.append(i)
+
+        def remove(items, positions, i):
+            last = items.pop()
+            if last != i:
+                items[positions[i]] = last
+                positions[last] = positions[i]
+
+        def move(i, b):
+            a = week[i]
+            ledger.remove(a, hrs[i])
+            ledger.place(b, hrs[i])
+            remove(members[a], member_pos, i)
+            member_pos[i] = len(members[b])
+            members[b].append(i)
+            if a == nominal[i]:
+                drifted_pos[i] = len(drifted)
+                drifted.append(i)
+            elif b == nominal[i]:
+                remove(drifted, drifted_pos, i)
+                drifted_pos[i] = -1
+            week[i] = b
+
+        rng = random.Random(self.seed)
+        first_week = ledger.first_week
+        balance = self.balance
+        deadline = time.perf_counter() + self.seconds
+        moves = shifts = swaps = stalled = 0
+        pending = None
+        drift_before = int(np.abs(weeks - np.asarray(nominal)).sum())
+
+        try:
+            while movable and stalled < self.patience:
+                moves += 1
+                stalled += 1
+                if not moves & 1023 and time.perf_counter() > deadline:
+                    break
+
+                # Half the moves bring a drifted occurrence closer to its original week, half go anywhere in its window
+                if drifted and rng.random() < 0.5:
+                    i = drifted[rng.randrange(len(drifted))]
+                    drift = abs(week[i] - nominal[i])
+                    b = nominal[i] + rng.randrange(1 - drift, drift)
+                else:
+                    i = movable[rng.randrange(len(movable))]
+                    b = nominal[i] + rng.randint(-windows[i], windows[i])
+                a = week[i]
+                if b == a or not ledger.covers(b):
+                    continue
+
+                h = hrs[i]
+                load_a, load_b = used_hours[a - first_week], used_hours[b - first_week]
+                if ledger.can_place(b, h):
+                    drift_gain = abs(b - nominal[i]) - abs(a - nominal[i])
+                    if drift_gain < 0 or balance and drift_gain == 0 and load_b + h < load_a:
+                        pending = (i, a, None, b)
+                        move(i, b)
+                        pending = None
+                        shifts += 1
+                        stalled = 0
+                    continue
+
+                # No room for i in week b: swap it with an occurrence of week b, if that fits in week a
+                occupants = members[b]
+                if not occupants:
+                    continue
+                j = occupants[rng.randrange(len(occupants))]
+                if abs(a - nominal[j]) > max(windows[j], abs(b - nominal[j])):
+                    continue
+                change = hrs[j] - h
+                if ledger.remaining_hours(a) < change or ledger.remaining_hours(b) < -change:
+                    continue
+                drift_gain = abs(b - nominal[i]) - abs(a - nominal[i]) + abs(a - nominal[j]) - abs(b - nominal[j])
+                # The squared hours of weeks a and b change by 2 * change * (load_a - load_b + change)
+                if drift_gain < 0 or balance and drift_gain == 0 and change * (load_a - load_b + change) < 0:
+                    pending = (i, a, j, b)
+                    move(i, b)
+                    move(j, a)
+                    pending = None
+                    swaps += 1
+                    stalled = 0
+        except KeyboardInterrupt:
+            if pending is not None:
+                i, a, j, b = pending
+                week[i] = a
+                if j is not None:
+                    week[j] = b
+
+        new_weeks = np.asarray(week, dtype=np.int64)
+        drift_after = int(np.abs(new_weeks - np.asarray(nominal)).sum())
+        self.stats = {"local_search_moves": moves, "local_search_shifts": shifts, "local_search_swaps": swaps,
+                      "local_search_drift_before": drift_before, "local_search_drift_after": drift_after}
+        if self.metrics is not None:
+            self.metrics.add_counts(**self.stats)
+
+        return LocalSearch.apply_weeks(sched, new_weeks - weeks, hardcap)
+
+    @staticmethod
+    def apply_weeks(sched, shifts, hardcap={}):
+        """
+        Function to move every occurrence of sched by shifts weeks (np.ndarray, one per row), returning a copy sorted by
+        ScheduledWeek.
+        """
+        reset_index = isinstance(sched.index, pd.RangeIndex)
+        sched = sched.copy()
+        moved = np.flatnonzero(shifts)
+        if len(moved):
+            shift = shifts[moved]
+            col = sched.columns.get_loc
+            new_weeks = pd.DatetimeIndex(week_starts(week_ordinals(sched["ScheduledWeek"].iloc[moved]) + shift))
+            delta_weeks = sched["DeltaWeeks"].to_numpy()[moved] + shift
+            sched.iloc[moved, col("ScheduledWeek")] = new_weeks
+            sched.iloc[moved, col("DeltaWeeks")] = delta_weeks
+
+            # Top-down schedules also carry the date, year and week of every occurrence
+            if "Scheduled_Date" in sched.columns:
+                sched.iloc[moved, col("Scheduled_Date")] = \
+                    sched["Scheduled_Date"].iloc[moved] + pd.to_timedelta(shift * 7, unit="D")
+                sched.iloc[moved, col("Year")] = new_weeks.year
+                sched.iloc[moved, col("Week")] = [AbstractScheduleAlgorithm.week_helper(week, n) for week, n in
+                                                  zip(sched["Week"].iloc[moved].tolist(), shift.tolist())]
+            if "DeltaDays" in sched.columns:
+                sched["DeltaDays"] = sched["DeltaWeeks"] * 7
+            if "HardCapped" in sched.columns:
+                caps = sched["TaskSequence_Weeks"].iloc[moved].map(hardcap).to_numpy()
+                sched.iloc[moved, col("HardCapped")] = (np.abs(delta_weeks) >= caps).astype(int)
+
+        sched = sched.sort_values(by="ScheduledWeek", kind="stable")
+        if reset_index:
+            sched = sched.reset_index(drop=True)
+        return sched
@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+from .AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from .BottomUpBackScheduler import BottomUpBackScheduler
+from .CapacityLedger import CapacityLedger, week_ordinals, week_ceil
+from .ScheduleSink import ScheduleSink
+
+try:
+    from scipy.optimize import milp, Bounds, LinearConstraint
+    from scipy.sparse import coo_matrix
+except ImportError:
+    milp = None
+
+
+class OptimalScheduler(AbstractScheduleAlgorithm):
+    # Number of weeks an occurrence of a task without a hard cap may move either way. Doubled (up to max_shift_limit)
+    # for a block that cannot be scheduled within it.
+    max_shift = 4
+    max_shift_limit = 64
+    # Number of weeks of occurrences solved together, and the time limit of each solve in seconds (None for no limit).
+    # Solve times grow quickly with the block size when weeks are close to fully booked.
+    block_weeks = 13
+    time_limit = None
+
+    def create_schedule(self, clean_df, wm_df, forecast_years, hardcap={}):
+        """
+        Idea: schedule every occurrence at once as an assignment of occurrences to weeks, solved to optimality as a
+        mixed integer linear program with scipy.optimize.milp (HiGHS), instead of greedily.
+
+        Every task occurs every TaskSequence_Weeks from its ConsolidatedDates week until the forecast end, as in the
+        bottom-up schedulers. An occurrence may move up to its hard cap (hardcap[TaskSequence_Weeks]), or max_shift
+        weeks otherwise, either way from its week, into weeks of the weeks master. The program minimises the total
+        |DeltaWeeks| subject to AllowedHours and AllowedTasks in every week.
+
+        Meta Algorithm:
+            1. Expand every task into its occurrences (week ordinal and TotalCount).
+            2. Split the occurrences into blocks of block_weeks weeks, solved in order. Each block only sees the
+               capacity left by the blocks before it (a CapacityLedger), so blocks stay small while occurrences still
+               move across block boundaries.
+            3. Within a block, occurrences of the same week, hours and allowed shift are interchangeable: the program
+               has one integer variable per such group and shift (the number of its occurrences moved by that shift),
+               rather than one binary per occurrence and shift.
+            4. Hand the shifts of each group out to its occurrences, the largest shifts to the least frequent tasks.
+
+        Trades share the capacity of the weeks master here like in every other scheduler; to decompose by trade as
+        well, schedule trades independently with Scheduler.schedule_all_trades.
+
+        Parameters:
+        - clean_df: pd.DataFrame or SharedScheduleInputs. Cleaned input data loaded to Dataframe form.
+        - wm_df: pd.DataFrame. Weeks master with the AllowedHours and AllowedTasks of every week.
+        - forecast_years: int. Adjusts the number of years to forecast into the future.
+        - hardcap: dict[TaskSequence_Weeks -> int]. Maximum |DeltaWeeks| of the tasks of each frequency.
+        """
+        assert milp is not None, "OptimalScheduler needs scipy (scipy.optimize.milp)!"
+        metrics = self.get_metrics()
+        clean_df, wm_df = AbstractScheduleAlgorithm.resolve_inputs(clean_df, wm_df)
+        ledger = CapacityLedger(wm_df)
+        end_week = week_ceil(pd.Timestamp.today() + pd.DateOffset(years=forecast_years))
+
+        with metrics.phase("build_occurrences"):
+            task_ordinals, weeks, total_counts = OptimalScheduler.build_occurrences(clean_df, end_week)
+            hrs = clean_df["Hrs"].to_numpy()[task_ordinals]
+            seq_weeks = clean_df["TaskSequence_Weeks"].to_numpy(dtype=np.int64)[task_ordinals]
+            capped = np.array([freq in hardcap for freq in seq_weeks.tolist()], dtype=bool)
+            windows = np.array([hardcap.get(freq, self.max_shift) for freq in seq_weeks.tolist()], dtype=np.int64)
+
+        delta_weeks = np.zeros(len(weeks), dtype=np.int64)
+        with metrics.phase("solve"):
+            blocks = (weeks - weeks.min()) // self.block_weeks if len(weeks) else weeks
+            for block in np.unique(blocks):
+                members = np.flatnonzero(blocks == block)
+                delta_weeks[members] = self.solve_block(ledger, weeks[members], hrs[members], seq_weeks[members],
+                                                        windows[members], capped[members])
+                ledger.load(weeks[members] + delta_weeks[members], hrs[members])
+                metrics.count("blocks")
+
+        with metrics.phase("output"):
+            sink = ScheduleSink({"TaskOrdinal": np.int64, "ScheduledWeek": np.int64, "DeltaWeeks": np.int64,
+                                 "TotalCount": np.int64}, capacity=max(len(weeks), 1))
+            sink.extend(task_ordinals, weeks + delta_weeks, delta_weeks, total_counts)
+            schedule_df = BottomUpBackScheduler.schedule_to_frame(sink, clean_df)
+        if self.validate:
+            with metrics.phase("validation"):
+                AbstractScheduleAlgorithm.check_valid_schedule(schedule_df, wm_df, type(self).__name__)
+                AbstractScheduleAlgorithm.check_complete_task_list(clean_df, schedule_df, type(self).__name__)
+        return schedule_df
+
+    @staticmethod
+    def build_occurrences(clean_df, end_week):
+        """
+        Function to expand every task of clean_df into its occurrences before end_week, as the bottom-up schedulers do
+        (the first occurrence is always kept). Returns the task ordinal (row in clean_df), week ordinal and TotalCount
+        of every occurrence, task by task.
+        """
+        first_weeks = week_ordinals(clean_df["ConsolidatedDates"])
+        seq_weeks = clean_df["TaskSequence_Weeks"].to_numpy(dtype=np.int64)
+        assert (seq_weeks > 0).all(), "TaskSequence_Weeks must be a positive number of weeks for every task!"
+
+        counts = np.maximum(-(-(end_week - first_weeks) // seq_weeks), 1)
+        task_ordinals = np.repeat(np.arange(len(clean_df)), counts)
+        starts = np.cumsum(counts) - counts
+        occurrence = np.arange(len(task_ordinals)) - np.repeat(starts, counts)
+        weeks = first_weeks[task_ordinals] + occurrence * seq_weeks[task_ordinals]
+        return task_ordinals, weeks, occurrence + 1
+
+    def solve_block(self, ledger, weeks, hrs, seq_weeks, windows, capped):
+        """
+        Function to find the DeltaWeeks of the occurrences of one block that minimise their total |DeltaWeeks| within
+        the capacity left in ledger (see create_schedule() steps 3 and 4). windows are the maximum |DeltaWeeks| of
+        each occurrence; those not capped are widened when the block is proven infeasible.
+        """
+        metrics = self.get_metrics()
+        windows = windows.copy()
+        while True:
+            counts = self._solve_groups(ledger, weeks, hrs, windows)
+            if counts is not None:
+                break
+            widen = ~capped & (windows < self.max_shift_limit)
+            assert widen.any(), \
+                f"Hard cap constraint too strict to schedule the weeks {weeks.min()} to {weeks.max()}!"
+            windows[widen] = np.minimum(2 * windows[widen], self.max_shift_limit)
+            metrics.count("widened_blocks")
+
+        group_of, group_shifts, shift_counts = counts
+        # Shifts of each group sorted by |DeltaWeeks|, and its occurrences from the most to the least frequent task
+        shifts = np.repeat(group_shifts[:, 1], shift_counts)
+        shift_order = np.lexsort((np.abs(shifts), np.repeat(group_shifts[:, 0], shift_counts)))
+        member_order = np.lexsort((np.arange(len(weeks)), seq_weeks, group_of))
+        delta_weeks = np.empty(len(weeks), dtype=np.int64)
+        delta_weeks[member_order] = shifts[shift_order]
+        return delta_weeks
+
+    def _solve_groups(self, ledger, weeks, hrs, windows):
+        # Returns the group of each occurrence, the (group, shift) of every variable and how many occurrences of the
+        # group take that shift, or None if the block is infeasible. With a time limit, the best solution found in
+        # time is used, and a TimeoutError is raised if none was
+        metrics = self.get_metrics()
+        groups, group_of, group_sizes = np.unique(np.stack([weeks, hrs, windows], axis=1), axis=0,
+                                                  return_inverse=True, return_counts=True)
+        group_of = group_of.ravel()
+        group_weeks = groups[:, 0].astype(np.int64)
+        group_hrs = groups[:, 1]
+        group_windows = groups[:, 2].astype(np.int64)
+
+        # One variable per group and shift landing in a week of the ledger
+        variable_group = np.repeat(np.arange(len(groups)), 2 * group_windows + 1)
+        variable_shift = np.arange(len(variable_group)) - np.repeat(np.cumsum(2 * group_windows + 1)
+                                                                     - (2 * group_windows + 1), 2 * group_windows + 1)
+        variable_shift -= group_windows[variable_group]
+        target = group_weeks[variable_group] + variable_shift
+        covered = np.array([ledger.covers(week) for week in target.tolist()], dtype=bool)
+        variable_group, variable_shift, target = variable_group[covered], variable_shift[covered], target[covered]
+        if np.setdiff1d(np.arange(len(groups)), variable_group).size:
+            return None
+
+        target_weeks, target_row = np.unique(target, return_inverse=True)
+        positions = target_weeks - ledger.first_week
+        remaining_hours = np.asarray(ledger.allowed_hours)[positions] - np.asarray(ledger.used_hours)[positions]
+        remaining_tasks = np.asarray(ledger.allowed_tasks)[positions] - np.asarray(ledger.used_tasks)[positions]
+
+        columns = np.arange(len(variable_group))
+        shape = (len(groups), len(columns))
+        assign = coo_matrix((np.ones(len(columns)), (variable_group, columns)), shape=shape)
+        shape = (len(target_weeks), len(columns))
+        hours = coo_matrix((group_hrs[variable_group].astype(float), (target_row, columns)), shape=shape)
+        tasks = coo_matrix((np.ones(len(columns)), (target_row, columns)), shape=shape)
+
+        options = {} if self.time_limit is None else {"time_limit": self.time_limit}
+        result = milp(np.abs(variable_shift).astype(float),
+                      integrality=np.ones(len(columns)),
+                      bounds=Bounds(0, group_sizes[variable_group]),
+                      constraints=[LinearConstraint(assign.tocsr(), group_sizes, group_sizes),
+                                   LinearConstraint(hours.tocsr(), -np.inf, remaining_hours),
+                                   LinearConstraint(tasks.tocsr(), -np.inf, remaining_tasks)],
+                      options=options)
+        metrics.add_counts(solves=1, groups=len(groups), variables=len(columns))
+        if result.x is None:
+            # Only a proven infeasible block (status 2) is worth widening; a time limit says nothing about feasibility
+            if result.status == 2:
+                return None
+            if result.status == 1:
+                raise TimeoutError(f"No solution found for the weeks {weeks.min()} to {weeks.max()} within "
+                                   f"time_limit={self.time_limit}s, raise or remove time_limit!")
+            raise RuntimeError(f"milp failed for the weeks {weeks.min()} to {weeks.max()}: {result.message}")
+
+        shift_counts = np.round(result.x).astype(np.int64)
+        used = shift_counts > 0
+        return group_of, np.stack([variable_group[used], variable_shift[used]], axis=1), shift_counts[used]
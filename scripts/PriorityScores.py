@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from .AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+
+
+def week_priority_score(task_sequence_weeks, task_hrs, delta_weeks, scale=0.25):
+    """
+    Function to compute the WeekPriorityScore of the top-down schedulers. A larger score indicates that the task is
+    moved first when its week is overbooked.
+    """
+    return task_sequence_weeks // (delta_weeks + 1) + scale * task_hrs
+
+
+class PriorityScoreTable:
+    """
+    Lookup table of a priority score formula, for every (TaskSequence_Weeks, Hrs) pair of a set of tasks and every
+    DeltaWeeks from 0 up to the depth of the table.
+
+    Scores only depend on those three values (plus the hard caps or scale, fixed for a run), so they are computed once
+    per distinct pair and DeltaWeeks with the formula itself, and are bit-identical to calling it. Tasks are referred
+    to by index in the arrays the table was built from. Hot loops index the per-task rows (lists shared by all tasks
+    of a pair) directly, falling back to score() past the end of a row or for a negative DeltaWeeks:
+
+        row = table.task_rows[i]
+        score = row[delta] if 0 <= delta < len(row) else table.score(i, delta)
+
+    lookup() does the same for arrays of tasks and DeltaWeeks at once.
+    """
+    def __init__(self, formula, seq_weeks, hrs, depth=64):
+        """
+        Parameters:
+        - formula: callable(TaskSequence_Weeks, Hrs, DeltaWeeks) -> score.
+        - seq_weeks, hrs: array-like. TaskSequence_Weeks and Hrs of every task.
+        - depth: int. Default=64. Initial number of DeltaWeeks per row, rows grow on demand.
+        """
+        self.formula = formula
+        seq_weeks, hrs = np.asarray(seq_weeks), np.asarray(hrs)
+        # No tasks (e.g. a reschedule that only removes tasks): pd.MultiIndex cannot be built from empty arrays
+        if not len(seq_weeks):
+            self.task_class = np.empty(0, dtype=np.int64)
+            self.pairs, self.rows, self.task_rows = [], [], []
+            self.table = np.empty((0, depth), dtype=np.float64)
+            return
+        codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([seq_weeks, hrs]))
+        self.task_class = codes
+        self.pairs = list(pairs)
+        self.rows = [[formula(seq, task_hrs, delta) for delta in range(depth)] for seq, task_hrs in self.pairs]
+        self.task_rows = [self.rows[code] for code in codes.tolist()]
+        self.table = np.array(self.rows, dtype=np.float64).reshape(len(self.rows), depth)
+
+    @classmethod
+    def for_heap(cls, seq_weeks, hrs, hardcap, depth=64):
+        """
+        Function to build the table of AbstractScheduleAlgorithm.priority_score(), the heap order of the bottom-up
+        schedulers.
+        """
+        return cls(lambda seq, task_hrs, delta: AbstractScheduleAlgorithm.priority_score(seq, task_hrs, delta, hardcap),
+                   seq_weeks, hrs, depth=depth)
+
+    @classmethod
+    def for_week(cls, seq_weeks, hrs, scale=0.25, depth=64):
+        """
+        Function to build the table of week_priority_score(), the WeekPriorityScore of the top-down schedulers.
+        """
+        return cls(lambda seq, task_hrs, delta: week_priority_score(seq, task_hrs, delta, scale), seq_weeks, hrs,
+                   depth=depth)
+
+    def score(self, i, delta):
+        if delta < 0:
+            seq, task_hrs = self.pairs[self.task_class[i]]
+            return self.formula(seq, task_hrs, delta)
+        if delta >= len(self.task_rows[i]):
+            self.grow(2 * delta + 1)
+        return self.task_rows[i][delta]
+
+    def grow(self, depth):
+        """
+        Function to extend every row to depth DeltaWeeks, in place so that task_rows stay valid.
+        """
+        for (seq, task_hrs), row in zip(self.pairs, self.rows):
+            row.extend(self.formula(seq, task_hrs, delta) for delta in range(len(row), depth))
+        self.table = np.array(self.rows, dtype=np.float64).reshape(len(self.rows), depth)
+
+    def lookup(self, tasks, deltas):
+        """
+        Function to get the scores of the tasks (indices) at the given DeltaWeeks, both array-like of the same length.
+        """
+        tasks = np.asarray(tasks, dtype=np.int64)
+        deltas = np.asarray(deltas, dtype=np.int64)
+        scores = np.empty(len(tasks), dtype=np.float64)
+        if not len(tasks):
+            return scores
+        inside = deltas >= 0
+        if inside.any() and deltas[inside].max() >= self.table.shape[1]:
+            self.grow(2 * int(deltas[inside].max()) + 1)
+        scores[inside] = self.table[self.task_class[tasks[inside]], deltas[inside]]
+        for k in np.flatnonzero(~inside).tolist():
+            scores[k] = self.score(tasks[k], deltas[k])
+        return scores
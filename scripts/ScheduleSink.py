@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+class ScheduleSink:
+    """
+    Append-only columnar buffer for placed task occurrences.
+
+    Each column is a preallocated typed np.ndarray that doubles in size when full, so appending an occurrence costs a
+    few scalar writes instead of a dict copy. With a spill_dir, every spill_rows occurrences are written out as one
+    chunk file and the buffers start over, so the sink itself never holds more than spill_rows occurrences in memory
+    until the final columns are built.
+    """
+    def __init__(self, columns, capacity=1024, spill_dir=None, spill_rows=2**20):
+        """
+        Parameters:
+        - columns: dict[str -> dtype]. Name and dtype of each column, in the order append() takes values.
+        - capacity: int. Default=1024. Initial number of rows of the buffers.
+        - spill_dir: str. Default=None. Directory to spill chunks to, in a temporary subdirectory removed by close().
+          None keeps everything in memory.
+        - spill_rows: int. Default=2**20. Number of rows per spilled chunk.
+        """
+        self.names = list(columns)
+        self.spill_path = tempfile.mkdtemp(prefix="schedule-sink-", dir=spill_dir) if spill_dir is not None else None
+        self.spill_rows = spill_rows
+        if self.spill_path is not None:
+            capacity = min(capacity, spill_rows)
+        self.buffers = [np.empty(capacity, dtype=dtype) for dtype in columns.values()]
+        self.size = 0
+        self.chunks = []
+
+    def __len__(self):
+        return sum(rows for _, rows in self.chunks) + self.size
+
+    def append(self, *values):
+        if self.size == len(self.buffers[0]):
+            self.make_room()
+        for buffer, value in zip(self.buffers, values):
+            buffer[self.size] = value
+        self.size += 1
+
+    def extend(self, *columns):
+        """
+        Function to append many rows at once, given as one array-like per column (in the order of append()).
+        """
+        columns = [np.asarray(column) for column in columns]
+        start, stop = 0, len(columns[0]) if columns else 0
+        while start < stop:
+            if self.size == len(self.buffers[0]):
+                self.make_room()
+            rows = min(len(self.buffers[0]) - self.size, stop - start)
+            for buffer, column in zip(self.buffers, columns):
+                buffer[self.size:self.size + rows] = column[start:start + rows]
+            self.size += rows
+            start += rows
+
+    def make_room(self):
+        if self.spill_path is not None and self.size >= self.spill_rows:
+            self.spill()
+        else:
+            self.grow()
+
+    def grow(self):
+        capacity = max(2 * len(self.buffers[0]), 1)
+        if self.spill_path is not None:
+            capacity = min(capacity, self.spill_rows)
+        self.buffers = [np.resize(buffer, capacity) for buffer in self.buffers]
+
+    def spill(self):
+        path = os.path.join(self.spill_path, f"chunk-{len(self.chunks)}.npz")
+        np.savez(path, **{name: buffer[:self.size] for name, buffer in zip(self.names, self.buffers)})
+        self.chunks.append((path, self.size))
+        self.size = 0
+
+    def columns(self, sort_by=None):
+        """
+        Function to get every appended row as a dict of column name -> np.ndarray, in append order or stably sorted
+        by the sort_by column.
+        """
+        columns = {}
+        for i, name in enumerate(self.names):
+            parts = []
+            for path, _ in self.chunks:
+                with np.load(path) as chunk:
+                    parts.append(chunk[name])
+            parts.append(self.buffers[i][:self.size])
+            columns[name] = np.concatenate(parts) if len(parts) > 1 else parts[0].copy()
+
+        if sort_by is not None:
+            order = np.argsort(columns[sort_by], kind='stable')
+            columns = {name: values[order] for name, values in columns.items()}
+        return columns
+
+    def close(self):
+        if self.spill_path is not None:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+            self.chunks = []
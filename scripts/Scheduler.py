@@ -1,31 +1,184 @@
 import os
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from .TopDownBackScheduler import TopDownBackScheduler
 from .TopDownFBScheduler import TopDownFBScheduler
 from .BottomUpBackScheduler import BottomUpBackScheduler
 from .BottomUpFBScheduler import BottomUpFBScheduler
-from .utils import produce_final_schedule
+from .OptimalScheduler import OptimalScheduler
+from .SharedInputs import SharedScheduleInputs
+from .Instrumentation import Metrics
+from .LocalSearch import LocalSearch
+from .AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from .utils import produce_final_schedule, frame_to_columns, columns_to_frame
 
 class Scheduler:
     def __init__(self, config, hardcap={}):
         self.output_dir = config["output_dir"]
         self.forecast_years = config["end_year"] - config["start_year"] - 2
         self.hardcap = hardcap  # TODO: include hardcap inside config
+        self.max_workers = config.get("max_workers")
+        self.validate = config.get("validate", True)
+        # Extension, and so format, of the final schedules: ".csv", ".csv.gz" or ".parquet" (see produce_final_schedule)
+        self.schedule_extension = config.get("schedule_extension", ".csv")
+        # Instrumentation of schedule(), see Instrumentation.Metrics
+        self.profile = config.get("profile", False)
+        self.trace_memory = config.get("trace_memory", False)
+        self.metrics_json = config.get("metrics_json", False)
+        self.metrics = None
+        # Seconds of LocalSearch improvement of every schedule after create_schedule, None or 0 to skip it
+        self.local_search_seconds = config.get("local_search_seconds")
 
     def schedule(self, clean_df, wm_df, alg_name, original_csv, trade=""):
+        """
+        Schedule clean_df with the alg_name algorithm and write the final schedule to the output directory.
+
+        Returns the metrics of the run (see Instrumentation.Metrics.as_dict()): the seconds spent in create_schedule,
+        in each of its phases and in produce_final_schedule, and the algorithm's counters (heap pops, constraint
+        checks, shifts, hard cap hits, ...). With config["profile"] and/or config["trace_memory"] the run is also
+        profiled with cProfile and/or tracemalloc, and with config["metrics_json"] the metrics are written to
+        alg_name + trade + "-Metrics.json" next to the schedule. They are kept on self.metrics as well.
+
+        With config["local_search_seconds"], the schedule is improved by LocalSearch for that many seconds before it
+        is written out.
+        """
+        metrics = Metrics(profile=self.profile, trace_memory=self.trace_memory)
         scheduler = get_scheduler(alg_name)
-        sched = scheduler.create_schedule(clean_df, wm_df, forecast_years=self.forecast_years, hardcap=self.hardcap)
-        produce_final_schedule(sched, original_csv, os.path.join(self.output_dir, alg_name + trade + "-Final-Schedule" + ".csv"))
+        scheduler.validate = self.validate
+        scheduler.metrics = metrics
+        with metrics.capture():
+            with metrics.phase("create_schedule"):
+                sched = scheduler.create_schedule(clean_df, wm_df, forecast_years=self.forecast_years, hardcap=self.hardcap)
+            if self.local_search_seconds:
+                with metrics.phase("local_search"):
+                    sched = LocalSearch(seconds=self.local_search_seconds, metrics=metrics).improve(
+                        sched, AbstractScheduleAlgorithm.resolve_inputs(clean_df, wm_df)[1], hardcap=self.hardcap)
+            with metrics.phase("produce_final_schedule"):
+                produce_final_schedule(sched, original_csv, os.path.join(self.output_dir, alg_name + trade + "-Final-Schedule" + self.schedule_extension))
+        metrics.add_counts(scheduled_rows=len(sched))
+
+        self.metrics = metrics
+        if self.metrics_json:
+            metrics.to_json(os.path.join(self.output_dir, alg_name + trade + "-Metrics.json"))
+        return metrics.as_dict()
+
+    def schedule_all_trades(self, clean_df, wm_df, alg_name, original_csv, max_workers=None):
+        """
+        Schedule every trade of clean_df independently and in parallel, one trade per worker process.
+
+        Trades share no capacity in the weeks master, so each trade is scheduled against the full wm_df. The inputs are
+        put in shared memory once (see SharedScheduleInputs) and each worker attaches to them for its own trade, rather
+        than receiving pickled DataFrames. Worker schedules come back as compact columnar payloads (see
+        utils.frame_to_columns) and are merged into a single output, written to alg_name + "-Final-Schedule" +
+        config["schedule_extension"] (".csv" by default).
+
+        Parameters:
+        - max_workers: int. Default=None. Number of worker processes, falls back to config["max_workers"] and then to
+          the number of trades (capped at the CPU count).
+        """
+        with SharedScheduleInputs.create(clean_df, wm_df) as inputs:
+            trades = inputs.trades()
+            max_workers = max_workers or self.max_workers or min(len(trades), os.cpu_count() or 1)
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [
+                    executor.submit(_create_schedule, alg_name, inputs.for_trade(trade), self.forecast_years, self.hardcap,
+                                    self.validate, self.local_search_seconds)
+                    for trade in trades
+                ]
+                scheds = [columns_to_frame(future.result()) for future in futures]
+
+        sched = pd.concat(scheds, ignore_index=True).sort_values(by="ScheduledWeek", kind="stable")
+        produce_final_schedule(sched, original_csv, os.path.join(self.output_dir, alg_name + "-Final-Schedule" + self.schedule_extension))
+        return sched
+
+    def tournament(self, clean_df, wm_df, original_csv, alg_names=None, max_workers=None):
+        """
+        Run several scheduling algorithms concurrently over the same cleaned input and weeks master, one process each,
+        score every result with score_schedule() and write out only the best schedule plus a comparison table.
+
+        clean_df and wm_df are prepared once by the caller and put in shared memory once for all workers. The best schedule has
+        the fewest HardCapHits, then the lowest TotalDrift, then the highest Utilization. Algorithms that fail (e.g.
+        on a hard cap assertion) are kept in the table with their error and never picked.
+
+        Parameters:
+        - alg_names: list[str]. Default=None. Algorithms to compare, defaults to every name in SCHEDULERS.
+        - max_workers: int. Default=None. Number of worker processes, falls back to config["max_workers"] and then to
+          the number of algorithms (capped at the CPU count).
+
+        Returns (best algorithm name, best schedule, comparison table).
+        """
+        alg_names = list(alg_names or SCHEDULERS)
+        max_workers = max_workers or self.max_workers or min(len(alg_names), os.cpu_count() or 1)
+
+        with SharedScheduleInputs.create(clean_df, wm_df) as inputs, \
+                ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                alg_name: executor.submit(_create_schedule, alg_name, inputs, self.forecast_years, self.hardcap, self.validate,
+                                          self.local_search_seconds)
+                for alg_name in alg_names
+            }
+            scheds, rows = {}, []
+            for alg_name, future in futures.items():
+                try:
+                    scheds[alg_name] = columns_to_frame(future.result())
+                except Exception as e:
+                    rows.append({"Algorithm": alg_name, "Error": repr(e)})
+                    continue
+                rows.append({"Algorithm": alg_name, **score_schedule(scheds[alg_name], wm_df, self.hardcap), "Error": ""})
+
+        comparison = pd.DataFrame(rows, columns=["Algorithm", "HardCapHits", "TotalDrift", "Utilization", "Error"])
+        comparison["Failed"] = comparison["Error"] != ""
+        comparison = comparison.sort_values(by=["Failed", "HardCapHits", "TotalDrift", "Utilization"],
+                                            ascending=[True, True, True, False], kind="stable").drop(columns="Failed")
+        comparison.to_csv(os.path.join(self.output_dir, "Tournament-Comparison.csv"), index=False)
+
+        assert scheds, f"Every algorithm failed to schedule: {dict(zip(comparison['Algorithm'], comparison['Error']))}"
+        best = comparison["Algorithm"].iloc[0]
+        produce_final_schedule(scheds[best], original_csv, os.path.join(self.output_dir, best + "-Final-Schedule" + self.schedule_extension))
+        return best, scheds[best], comparison
+
+
+def _create_schedule(alg_name, inputs, forecast_years, hardcap, validate=True, local_search_seconds=None):
+    # Runs in a worker process: inputs is a SharedScheduleInputs bundle, the output a frame_to_columns() payload
+    scheduler = get_scheduler(alg_name)
+    scheduler.validate = validate
+    sched = scheduler.create_schedule(inputs, None, forecast_years=forecast_years, hardcap=hardcap)
+    if local_search_seconds:
+        wm_df = AbstractScheduleAlgorithm.resolve_inputs(inputs, None)[1]
+        sched = LocalSearch(seconds=local_search_seconds).improve(sched, wm_df, hardcap=hardcap)
+    return frame_to_columns(sched)
+
+
+SCHEDULERS = {
+    "top-down-b": TopDownBackScheduler,
+    "top-down-fb": TopDownFBScheduler,
+    "bottom-up-b": BottomUpBackScheduler,
+    "bottom-up-fb": BottomUpFBScheduler,
+    "optimal": OptimalScheduler,
+}
 
 
 def get_scheduler(name):
-    if name == "top-down-b":
-        scheduler = TopDownBackScheduler()
-    elif name == "top-down-fb":
-        scheduler = TopDownFBScheduler()
-    elif name == "bottom-up-b":
-        scheduler = BottomUpBackScheduler()
-    elif name == "bottom-up-fb":
-        scheduler = BottomUpFBScheduler()
-    else:
-        raise ValueError
-    return scheduler
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduling algorithm {name}, expected one of {list(SCHEDULERS)}")
+    return SCHEDULERS[name]()
+
+
+def score_schedule(sched, wm_df, hardcap={}):
+    """
+    Function to score a schedule for comparing algorithms:
+    - TotalDrift: sum of |DeltaWeeks| over all occurrences.
+    - HardCapHits: number of occurrences whose |DeltaWeeks| reached the hard cap of their TaskSequence_Weeks.
+    - Utilization: scheduled hours over allowed hours, across the weeks master weeks spanned by the schedule.
+    """
+    delta_weeks = sched["DeltaWeeks"].abs()
+    caps = sched["TaskSequence_Weeks"].map(hardcap)
+    span = (wm_df["ScheduledWeek"] >= sched["ScheduledWeek"].min()) & (wm_df["ScheduledWeek"] <= sched["ScheduledWeek"].max())
+    allowed_hours = wm_df.loc[span, "AllowedHours"].sum()
+
+    return {
+        "TotalDrift": int(delta_weeks.sum()),
+        "HardCapHits": int((delta_weeks >= caps).sum()),
+        "Utilization": float(sched["Hrs"].sum() / allowed_hours) if allowed_hours else float("nan"),
+    }
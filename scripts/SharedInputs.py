@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory, util
+
+
+# Every column starts on an 8 byte boundary of the shared block
+_ALIGNMENT = 8
+
+# Attachments made by this (worker) process, reused across tasks sent to the same worker and closed when it exits
+_attached = {}
+
+
+class SharedScheduleInputs:
+    """
+    Columnar bundle of a cleaned task frame (clean_dataframe() output) and a weeks master frame, backed by a single
+    multiprocessing.shared_memory block so that scheduling workers can read the same inputs without each getting a
+    pickled copy.
+
+    - numeric columns are stored as raw arrays, datetimes as int64 nanoseconds
+    - string columns (DataSource, TaskDescription, Trade, ...) are stored as int32 codes into one interned string
+      table shared by every column, so each distinct string is held once
+
+    The creating process owns the block: use it as a context manager, or call close() and unlink() when done.
+    Pickling a bundle only sends its handle (block name and column layout), and unpickling it in a worker attaches to
+    the existing block, so bundles can be passed straight to ProcessPoolExecutor.submit(). Column arrays returned by
+    task_columns()/weeks_columns() are read-only views into the block; task_frame()/weeks_frame() build DataFrames
+    from them, which the scheduler classes accept directly (see AbstractScheduleAlgorithm.resolve_inputs).
+
+    The frames do not copy the block: numeric and datetime columns stay read-only views into it, and string columns
+    are Categoricals over the string table (string_dtype()), so a worker only holds each distinct string once. The
+    schedulers add or replace columns of their inputs but never write into them, so no column is copied. Only the
+    Categorical codes (narrowed to the smallest integer type by pandas), nullable extension columns and the rows of a
+    for_trade() view are copies.
+    """
+    def __init__(self, shm, layout, owner=False, trade=None):
+        self.shm = shm
+        self.layout = layout
+        self.owner = owner
+        self.trade = trade
+        self._strings = None
+        self._string_dtype = None
+
+    @classmethod
+    def create(cls, clean_df, wm_df):
+        strings = {}
+        columns = []
+        for frame_name, df in (("tasks", clean_df), ("weeks", wm_df)):
+            for col in df.columns:
+                columns.append((frame_name, col) + _encode_column(df[col], strings))
+
+        table = list(strings)
+        encoded = [s.encode("utf-8") for s in table]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        string_offsets[1:] = np.cumsum([len(b) for b in encoded])
+        columns.append(("strings", "offsets", "array", str(string_offsets.dtype), string_offsets))
+        columns.append(("strings", "blob", "array", "uint8", np.frombuffer(b"".join(encoded), dtype=np.uint8)))
+
+        layout, size = [], 0
+        for frame_name, col, kind, dtype, values in columns:
+            layout.append((frame_name, col, kind, dtype, values.dtype.str, size, len(values)))
+            size += -(-values.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for (_, _, _, _, _, offset, length), (*_, values) in zip(layout, columns):
+            np.ndarray(length, dtype=values.dtype, buffer=shm.buf, offset=offset)[:] = values
+        return cls(shm, layout, owner=True)
+
+    @classmethod
+    def attach(cls, handle):
+        if handle["name"] not in _attached:
+            if not _attached:
+                # Run by multiprocessing when the worker exits, which skips atexit handlers
+                util.Finalize(None, _close_attached, exitpriority=10)
+            _attached[handle["name"]] = shared_memory.SharedMemory(name=handle["name"])
+        return cls(_attached[handle["name"]], handle["layout"], trade=handle["trade"])
+
+    @property
+    def handle(self):
+        return {"name": self.shm.name, "layout": self.layout, "trade": self.trade}
+
+    def __reduce__(self):
+        return SharedScheduleInputs.attach, (self.handle,)
+
+    def for_trade(self, trade):
+        """
+        Function to get a view of the bundle whose task_frame() only holds the tasks of one Trade.
+        """
+        return SharedScheduleInputs(self.shm, self.layout, trade=trade)
+
+    def trades(self):
+        """
+        Function to list the distinct Trade values of the tasks, in order of first appearance.
+        """
+        codes = self._array("tasks", "Trade")
+        _, first = np.unique(codes, return_index=True)
+        strings = self.strings()
+        return [strings[code] for code in codes[np.sort(first)]]
+
+    def strings(self):
+        """
+        Function to get the interned string table, decoded once per bundle.
+        """
+        if self._strings is None:
+            offsets = self._array("strings", "offsets")
+            blob = self._array("strings", "blob").tobytes()
+            self._strings = [blob[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        return self._strings
+
+    def string_dtype(self):
+        """
+        Function to get the pd.CategoricalDtype over the interned string table that string columns are read as, built
+        once per bundle.
+        """
+        if self._string_dtype is None:
+            self._string_dtype = pd.CategoricalDtype(pd.Index(self.strings(), dtype=object))
+        return self._string_dtype
+
+    def task_columns(self):
+        columns = self._columns("tasks")
+        if self.trade is not None:
+            rows = self._array("tasks", "Trade") == self.strings().index(self.trade)
+            columns = {col: (kind, dtype, values[rows]) for col, (kind, dtype, values) in columns.items()}
+        return columns
+
+    def weeks_columns(self):
+        return self._columns("weeks")
+
+    def task_frame(self):
+        return self._frame(self.task_columns())
+
+    def weeks_frame(self):
+        return self._frame(self.weeks_columns())
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.close()
+        finally:
+            self.unlink()
+
+    def _array(self, frame_name, col):
+        for frame, column, kind, dtype, array_dtype, offset, length in self.layout:
+            if frame == frame_name and column == col:
+                values = np.ndarray(length, dtype=np.dtype(array_dtype), buffer=self.shm.buf, offset=offset)
+                values.flags.writeable = False
+                return values
+        raise KeyError(col)
+
+    def _columns(self, frame_name):
+        return {
+            col: (kind, dtype, self._array(frame_name, col))
+            for frame, col, kind, dtype, *_ in self.layout if frame == frame_name
+        }
+
+    def _frame(self, columns):
+        data = {}
+        for col, (kind, dtype, values) in columns.items():
+            if kind == "datetime":
+                data[col] = values.view("datetime64[ns]")
+            elif kind == "codes":
+                data[col] = pd.Categorical.from_codes(values, dtype=self.string_dtype())
+            else:
+                data[col] = pd.array(values, dtype=dtype) if dtype != values.dtype.name else values
+        return pd.DataFrame(data, columns=list(columns), copy=False)
+
+
+def _close_attached():
+    for shm in _attached.values():
+        try:
+            shm.close()
+        except BufferError:
+            # Frames still view the block, the mapping is released with the process
+            pass
+    _attached.clear()
+
+
+def _encode_column(series, strings):
+    # Returns (kind, original dtype name, values) for one column, adding new strings to the interned table
+    if pd.api.types.is_datetime64_dtype(series.dtype):
+        return "datetime", "datetime64[ns]", series.to_numpy(dtype="datetime64[ns]").view(np.int64)
+    if series.dtype == object:
+        # Missing values are stored as code -1, which maps to the trailing np.nan in _frame()
+        codes, uniques = pd.factorize(series)
+        assert all(isinstance(value, str) for value in uniques), f"Column {series.name} holds non-string objects!"
+        table_codes = np.array([strings.setdefault(value, len(strings)) for value in uniques] + [-1], dtype=np.int32)
+        return "codes", "object", table_codes[codes]
+    if isinstance(series.dtype, np.dtype):
+        return "array", series.dtype.name, series.to_numpy()
+    # Nullable extension dtypes (e.g. the UInt32 Year/Week from isocalendar), restored on read
+    numpy_dtype = getattr(series.dtype, "numpy_dtype", np.dtype(float))
+    values = series.to_numpy(dtype=numpy_dtype if not series.isna().any() else float, na_value=np.nan)
+    return "array", series.dtype.name, values
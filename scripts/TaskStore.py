@@ -0,0 +1,36 @@
+import numpy as np
+from .CapacityLedger import week_ordinals
+
+
+class TaskStore:
+    """
+    Struct of arrays holding the scheduling state of every task in a heap scheduler, indexed by task ordinal.
+
+    Only the fields the heap loop needs are kept, as NumPy arrays: Key (used to break ties in the heap), Hrs,
+    TaskSequence_Weeks, and the week ordinal, DeltaWeeks and TotalCount of the task's next occurrence. Descriptive
+    columns (DataSource, TaskDescription, ...) stay in the task frame and are only joined back onto the placed
+    occurrences when the output is built, through task_ordinals (the row of each task in that frame).
+    """
+    __slots__ = ("keys", "task_ordinals", "hrs", "seq_weeks", "weeks", "delta_weeks", "total_counts")
+
+    def __init__(self, keys, task_ordinals, hrs, seq_weeks, weeks, delta_weeks=None, total_counts=None):
+        self.keys = np.asarray(keys)
+        self.task_ordinals = np.asarray(task_ordinals, dtype=np.int64)
+        self.hrs = np.asarray(hrs)
+        self.seq_weeks = np.asarray(seq_weeks, dtype=np.int64)
+        self.weeks = np.asarray(weeks, dtype=np.int64)
+        self.delta_weeks = np.zeros(len(self.keys), dtype=np.int64) if delta_weeks is None else \
+            np.asarray(delta_weeks, dtype=np.int64)
+        self.total_counts = np.zeros(len(self.keys), dtype=np.int64) if total_counts is None else \
+            np.asarray(total_counts, dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, clean_df):
+        """
+        Function to build the store of the first occurrence of every task in a cleaned task frame.
+        """
+        return cls(clean_df["Key"].to_numpy(), np.arange(len(clean_df)), clean_df["Hrs"].to_numpy(),
+                   clean_df["TaskSequence_Weeks"].to_numpy(), week_ordinals(clean_df["ConsolidatedDates"]))
+
+    def __len__(self):
+        return len(self.keys)
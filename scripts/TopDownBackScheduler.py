@@ -1,13 +1,24 @@
+import heapq
+import numpy as np
 import pandas as pd
+from collections import defaultdict
 from .AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from .CapacityLedger import week_ordinal, week_ordinals, week_starts
+from .PriorityScores import PriorityScoreTable
 
 
 class TopDownBackScheduler(AbstractScheduleAlgorithm):
     def create_schedule(self, clean_df, wm_df, forecast_years, hardcap):
-        base_sched = AbstractScheduleAlgorithm.build_base_top_down_schedule(clean_df, forecast_years=forecast_years)
-        sched_df = self.do_weekly_hour_cap(base_sched, wm_df, hardcap=hardcap)
-        AbstractScheduleAlgorithm.check_valid_schedule(sched_df, wm_df, type(self).__name__)
-        AbstractScheduleAlgorithm.check_complete_task_list(clean_df, sched_df, type(self).__name__)
+        metrics = self.get_metrics()
+        clean_df, wm_df = AbstractScheduleAlgorithm.resolve_inputs(clean_df, wm_df)
+        with metrics.phase("base_schedule"):
+            base_sched = AbstractScheduleAlgorithm.build_base_top_down_schedule(clean_df, forecast_years=forecast_years)
+        with metrics.phase("weekly_hour_cap"):
+            sched_df = self.do_weekly_hour_cap(base_sched, wm_df, hardcap=hardcap)
+        if self.validate:
+            with metrics.phase("validation"):
+                AbstractScheduleAlgorithm.check_valid_schedule(sched_df, wm_df, type(self).__name__)
+                AbstractScheduleAlgorithm.check_complete_task_list(clean_df, sched_df, type(self).__name__)
         return sched_df
 
 
@@ -24,6 +35,10 @@ class TopDownBackScheduler(AbstractScheduleAlgorithm):
                 ++ 7 to the deltadays for moved tasks
                 modify the scheduled Date field for moved tasks to same weekday of following week
                 modify to week field value for moved tasks
+
+            Tasks are bucketed by week once, and each week keeps a max heap of its movable tasks keyed on
+            WeekPriorityScore, so resolving a week's overflow costs time proportional to that week's tasks. Scores
+            are read from a PriorityScoreTable rather than recomputed after every move.
         """
 
         # TODO: maybe augment priority scoring metric with a hard cap on DeltaWeeks and/or DeltaDays?
@@ -31,36 +46,80 @@ class TopDownBackScheduler(AbstractScheduleAlgorithm):
         # little more flexibility with longer-term frequency tasks beyond that, but hard caps still good idea
         # maybe soft-code as arguments/dropdowns in the gui
 
-        df['WeekPriorityScore'] = pd.eval(f"(df.TaskSequence_Weeks)//(df.DeltaWeeks+1) + {scale}*df.Hrs")
+        scores = PriorityScoreTable.for_week(df['TaskSequence_Weeks'].to_numpy(), df['Hrs'].to_numpy(), scale)
+        df['WeekPriorityScore'] = scores.lookup(np.arange(len(df)), df['DeltaWeeks'])
 
         weekly_hours['HardCapped'] = 0
 
+        # Index the tasks by week once, instead of filtering the whole schedule for every week and after every move.
+        # Moves only touch these columns, which are written back to df at the end.
+        seq_weeks = df['TaskSequence_Weeks'].tolist()
+        hrs = df['Hrs'].tolist()
+        delta_weeks = df['DeltaWeeks'].tolist()
+        hard_capped = df['HardCapped'].tolist()
+        week_num = df['Week'].tolist()
+        score = df['WeekPriorityScore'].tolist()
+        task_weeks = week_ordinals(df['ScheduledWeek']).tolist()
+        moves = [0] * len(df)
+        overbooked_weeks = hard_cap_hits = 0
+
+        week_positions = defaultdict(list)
+        for position, week in enumerate(task_weeks):
+            week_positions[week].append(position)
+
+        def move_to_next_week(position, week):
+            week_num[position] = AbstractScheduleAlgorithm.week_helper(week_num[position])
+            task_weeks[position] = week + 1
+            moves[position] += 1
+            delta_weeks[position] += 1
+            row = scores.task_rows[position]
+            delta = delta_weeks[position]
+            score[position] = row[delta] if delta < len(row) else scores.score(position, delta)
+            week_positions[week + 1].append(position)
+
         for week in weekly_hours.to_dict('records'):
-            week_tasks = df.loc[df['ScheduledWeek'] == week['ScheduledWeek']]
-            next_week = pd.to_datetime(week['ScheduledWeek']) + pd.DateOffset(days=7)
+            week_index = week_ordinal(week['ScheduledWeek'])
+            positions = week_positions.pop(week_index, [])
             if week['AllowedHours'] == 0 or week['AllowedHours'] == 0:
-                for (i, row) in week_tasks.iterrows():
-                    df.at[i, 'Week'] = AbstractScheduleAlgorithm.week_helper(df.at[i, 'Week'])
-                    df.at[i, 'Scheduled_Date'] = df.at[i, 'Scheduled_Date'] + pd.DateOffset(days=7)
-                    df.at[i, 'ScheduledWeek'] = next_week
-                    df.at[i, 'DeltaWeeks'] += 1
-                    df.at[i, 'Year'] = df.at[i, 'ScheduledWeek'].year
-                    df['WeekPriorityScore'] = pd.eval(f"(df.TaskSequence_Weeks)//(df.DeltaWeeks+1)+ {scale}*df.Hrs")
+                for position in positions:
+                    move_to_next_week(position, week_index)
 
             else:
-                while week_tasks['Hrs'].sum() > week['AllowedHours'] or len(week_tasks) > week['AllowedTasks']:
-
-                    priority = week_tasks.loc[week_tasks['HardCapped'] == 0]['WeekPriorityScore'].idxmax()
-                    df.at[priority, 'Week'] = AbstractScheduleAlgorithm.week_helper(df.at[priority, 'Week'])
-                    df.at[priority, 'Scheduled_Date'] = df.at[priority, 'Scheduled_Date'] + pd.DateOffset(days=7)
-                    df.at[priority, 'ScheduledWeek'] = next_week
-                    df.at[priority, 'DeltaWeeks'] += 1
-                    if (freq := df.at[priority, 'TaskSequence_Weeks']) in hardcap.keys():
-                        if df.at[priority, 'DeltaWeeks'] >= hardcap[freq]:
-                            df.at[priority, 'HardCapped'] = 1
-                    df.at[priority, 'Year'] = df.at[priority, 'ScheduledWeek'].year
-                    df['WeekPriorityScore'] = pd.eval(f"(df.TaskSequence_Weeks)//(df.DeltaWeeks+1)+ {scale}*df.Hrs")
-                    week_tasks = df.loc[df['ScheduledWeek'] == week['ScheduledWeek']]
+                # Max heap of the week's movable tasks on WeekPriorityScore, ties going to the earliest row
+                week_hrs = sum(hrs[position] for position in positions)
+                num_tasks = len(positions)
+                movable = [(-score[position], position) for position in positions if hard_capped[position] == 0]
+                heapq.heapify(movable)
+                kept = set(positions)
+
+                overbooked_weeks += week_hrs > week['AllowedHours'] or num_tasks > week['AllowedTasks']
+                while week_hrs > week['AllowedHours'] or num_tasks > week['AllowedTasks']:
+                    assert movable, f"Every task left in week {week['ScheduledWeek']} is hard capped, cannot resolve overbooking!"
+                    _, position = heapq.heappop(movable)
+                    kept.discard(position)
+                    week_hrs -= hrs[position]
+                    num_tasks -= 1
+                    move_to_next_week(position, week_index)
+                    if (freq := seq_weeks[position]) in hardcap.keys():
+                        if delta_weeks[position] >= hardcap[freq]:
+                            hard_capped[position] = 1
+                            hard_cap_hits += 1
+
+                week_positions[week_index] = [position for position in positions if position in kept]
+
+        moved = np.flatnonzero(moves)
+        self.get_metrics().add_counts(overbooked_weeks=overbooked_weeks, forward_shifts=sum(moves),
+                                      moved_tasks=len(moved), hard_cap_hits=hard_cap_hits)
+        if len(moved):
+            shift = pd.to_timedelta(np.asarray(moves)[moved] * 7, unit='D')
+            new_weeks = pd.DatetimeIndex(week_starts(np.asarray(task_weeks)[moved]))
+            df.iloc[moved, df.columns.get_loc('Scheduled_Date')] = df['Scheduled_Date'].iloc[moved] + shift
+            df.iloc[moved, df.columns.get_loc('ScheduledWeek')] = new_weeks
+            df.iloc[moved, df.columns.get_loc('Year')] = new_weeks.year
+        df['Week'] = week_num
+        df['DeltaWeeks'] = delta_weeks
+        df['HardCapped'] = hard_capped
+        df['WeekPriorityScore'] = score
 
         df['WeekPriorityScore'].astype(int)
         df['DeltaDays'] = pd.eval('df.DeltaWeeks*7')
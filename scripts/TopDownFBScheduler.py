@@ -1,18 +1,30 @@
 import random
+import heapq
+import bisect
+import numpy as np
 import pandas as pd
+from collections import defaultdict
 from .AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from .CapacityLedger import CapacityLedger, week_ordinal, week_ordinals
+from .PriorityScores import PriorityScoreTable
 
 
 class TopDownFBScheduler(AbstractScheduleAlgorithm):
     def create_schedule(self, clean_df, wm_df, forecast_years, hardcap):
-        base_sched = AbstractScheduleAlgorithm.build_base_top_down_schedule(clean_df, forecast_years=forecast_years)
-        sched_df = self.weekly_fba(base_sched, wm_df, hardcap=hardcap)
-        AbstractScheduleAlgorithm.check_valid_schedule(sched_df, wm_df, type(self).__name__)
-        AbstractScheduleAlgorithm.check_complete_task_list(clean_df, sched_df, type(self).__name__)
+        metrics = self.get_metrics()
+        clean_df, wm_df = AbstractScheduleAlgorithm.resolve_inputs(clean_df, wm_df)
+        with metrics.phase("base_schedule"):
+            base_sched = AbstractScheduleAlgorithm.build_base_top_down_schedule(clean_df, forecast_years=forecast_years)
+        with metrics.phase("weekly_fba"):
+            sched_df = self.weekly_fba(base_sched, wm_df, hardcap=hardcap)
+        if self.validate:
+            with metrics.phase("validation"):
+                AbstractScheduleAlgorithm.check_valid_schedule(sched_df, wm_df, type(self).__name__)
+                AbstractScheduleAlgorithm.check_complete_task_list(clean_df, sched_df, type(self).__name__)
         return sched_df
 
 
-    def weekly_fba(self, sched, week_master_df, scale=0.25, hardcap={}, **kwargs):
+    def weekly_fba(self, sched, week_master_df, scale=0.25, hardcap={}, incremental=True, **kwargs):
         """
             Logic:
                 # 1. augment weeks master with AvailableHours column = AllowedHours - AssignedHours
@@ -29,7 +41,13 @@ class TopDownFBScheduler(AbstractScheduleAlgorithm):
                 # ^^ if it can, insert in the one with more free hours; if equal do a coin toss
                 # 8. re-update all AvailableHours column values again
                 # 9. loop through 2-8 until no weeks with negative AvailableHours
+
+            incremental=True keeps the week aggregates up to date one task move at a time (see weekly_fba_incremental)
+            instead of recomputing them over the whole schedule after every move. Both modes give identical schedules
+            for the same random seed.
         """
+        if incremental:
+            return self.weekly_fba_incremental(sched, week_master_df, scale=scale, hardcap=hardcap)
 
         # NOTE: issue here at start/end date boundary conditions;
         # sched df comes from schedule csv, weeksmaster is generated with defined bounds
@@ -169,4 +187,171 @@ class TopDownFBScheduler(AbstractScheduleAlgorithm):
         sched['WeekPriorityScore'].astype(float)
         sched['DeltaDays'] = pd.eval('sched.DeltaWeeks*7')
 
-        return sched
\ No newline at end of file
+        return sched
+
+    def weekly_fba_incremental(self, sched, week_master_df, scale=0.25, hardcap={}):
+        """
+            Same algorithm as weekly_fba, but instead of re-running the groupby/join over the whole schedule after every
+            task move, keeps:
+                - a CapacityLedger with the assigned hours and tasks of every week, updated for the moved task only
+                - the row positions of the tasks in every week, so a week's tasks are read without scanning the schedule
+                - a min heap of overbooked weeks, popped lazily once a week is no longer overbooked
+            so that each move costs time proportional to the tasks of the week being resolved. Scores are read from
+            a PriorityScoreTable rather than re-evaluated over the whole schedule.
+        """
+        scores = PriorityScoreTable.for_week(sched['TaskSequence_Weeks'].to_numpy(), sched['Hrs'].to_numpy(), scale)
+        sched['WeekPriorityScore'] = scores.lookup(np.arange(len(sched)), sched['DeltaWeeks'])
+        sched['WeekTasks'] = 1
+
+        # Weeks of the schedule that are not in the weeks master have no allowed hours or tasks
+        sched_weeks = week_ordinals(sched['ScheduledWeek'])
+        ledger = CapacityLedger(week_master_df, extra_weeks=sched_weeks)
+        ledger.load(sched_weeks, sched['Hrs'].to_numpy())
+
+        week_positions = defaultdict(list)
+        for position, week in enumerate(sched_weeks.tolist()):
+            week_positions[week].append(position)
+        master_weeks = set(week_ordinals(week_master_df['ScheduledWeek']).tolist())
+
+        overbooked = ledger.overbooked_weeks()
+        heapq.heapify(overbooked)
+        rescored = False
+        tts = None
+        resolved_weeks = window_expansions = forward_shifts = back_shifts = hard_cap_hits = 0
+
+        while overbooked:
+            if not ledger.is_overbooked(overbooked[0]):
+                heapq.heappop(overbooked)
+                resolved_weeks += 1
+                continue
+
+            week = overbooked[0]
+            hours = ledger.remaining_hours(week)
+            num_tasks = ledger.remaining_tasks(week)
+            tasks = sched.iloc[week_positions[week]]
+            range_start = next(w for w in range(ledger.first_week, week + 1) if ledger.covers(w))
+            range_end = next(w for w in range(ledger.first_week + len(ledger) - 1, week - 1, -1) if ledger.covers(w))
+
+            for i in range(len(tasks)):
+                if tasks.nlargest(i+1, 'WeekPriorityScore')['Hrs'].sum() >= abs(hours) or \
+                        tasks.nlargest(i+1, 'WeekPriorityScore')['WeekTasks'].sum() >= abs(num_tasks):
+                    tts = tasks.nlargest(i+1, 'WeekPriorityScore').sort_values(by='WeekPriorityScore', ascending=False)
+                    break
+
+            for (i, row) in tts.iterrows():
+                window = 1
+                adjacents = {}
+
+                if (freq := row['TaskSequence_Weeks']) in hardcap.keys():
+                    if row['DeltaWeeks'] >= hardcap[freq]:
+                        row['HardCapped'] = 1
+                        hard_cap_hits += 1
+                        print('hardcap breaK')
+                        break
+
+                if not row['HardCapped']:
+                    row_week = week_ordinal(row['ScheduledWeek'])
+                    while len(adjacents) == 0:
+                        offset = pd.DateOffset(days=7 * window)
+                        backdate = row['ScheduledWeek'] + offset
+                        fwddate = row['ScheduledWeek'] - offset
+                        try:
+                            if row_week == range_start:
+                                back = ledger.remaining_hours(row_week + window)
+                                back_tasks = ledger.remaining_tasks(row_week + window)
+                                if back >= row['Hrs'] and back_tasks >= row['WeekTasks']:
+                                    adjacents[backdate] = window
+                                else:
+                                    window += 1
+                                    if (freq := row['TaskSequence_Weeks']) in hardcap.keys():
+                                        if window > hardcap[freq]:
+                                            print('hardcap break 1')
+                                            break
+
+                            elif row_week == range_end:
+                                fwd = ledger.remaining_hours(row_week - window)
+                                fwd_tasks = ledger.remaining_tasks(row_week + window)
+                                if fwd >= row['Hrs'] and fwd_tasks >= row['WeekTasks']:
+                                    adjacents[fwddate] = -window
+                                else:
+                                    window += 1
+                                    if (freq := row['TaskSequence_Weeks']) in hardcap.keys():
+                                        if window > hardcap[freq]:
+                                            print('hardcap break 2')
+                                            break
+
+                            else:
+                                back = ledger.remaining_hours(row_week + window)
+                                fwd = ledger.remaining_hours(row_week - window)
+                                back_tasks = ledger.remaining_tasks(row_week + window)
+                                fwd_tasks = ledger.remaining_tasks(row_week + window)
+                                if back == fwd and fwd >= row['Hrs'] and fwd_tasks >= row['WeekTasks']:
+                                    adjacents[fwddate] = -window
+                                elif back >= row['Hrs'] and fwd >= row['Hrs'] and fwd_tasks >= row['WeekTasks'] and back_tasks >= row['WeekTasks']:
+                                    tmp_entry = backdate if back >= fwd else fwddate
+                                    adjacents[tmp_entry] = window if tmp_entry == backdate else -window
+                                elif fwd >= row['Hrs'] and fwd_tasks >= row['WeekTasks']:
+                                    adjacents[fwddate] = -window
+                                elif back >= row['Hrs'] and back_tasks >= row['WeekTasks']:
+                                    adjacents[backdate] = window
+                                else:
+                                    window += 1
+                                    if (freq := row['TaskSequence_Weeks']) in hardcap.keys():
+                                        if window > hardcap[freq]:
+                                            print('hardcap break 3')
+                                            break
+                        except KeyError:
+                            print('KeyError: boundary week may be out of range')
+                            break
+
+                    assert adjacents, f"Hard cap constraint too strict for task sequence week frequency {freq}!"
+                    shift = random.choice(list(adjacents.keys()))
+
+                    priority = row._name
+                    position = sched.index.get_loc(priority)
+                    shift_week = row_week + adjacents[shift]
+                    window_expansions += window - 1
+                    if adjacents[shift] > 0:
+                        forward_shifts += 1
+                    else:
+                        back_shifts += 1
+
+                    sched.at[priority, 'Week'] = AbstractScheduleAlgorithm.week_helper(sched.at[priority, 'Week'], adjacents[shift])
+                    sched.at[priority, 'Scheduled_Date'] = sched.at[priority, 'Scheduled_Date'] \
+                                                        + pd.DateOffset(days=7*adjacents[shift])
+                    sched.at[priority, 'ScheduledWeek'] = shift
+                    sched.at[priority, 'DeltaWeeks'] += adjacents[shift]
+                    if (freq := sched.at[priority, 'TaskSequence_Weeks']) in hardcap.keys():
+                        if abs(sched.at[priority, 'DeltaWeeks']) >= hardcap[freq]:
+                            sched.at[priority, 'HardCapped'] = 1
+                    sched.at[priority, 'Year'] = sched.at[priority, 'ScheduledWeek'].year
+
+                    # Only the moved task's score changes, once the whole column uses the |DeltaWeeks| score
+                    if not rescored:
+                        sched['WeekPriorityScore'] = scores.lookup(np.arange(len(sched)), sched['DeltaWeeks'].abs())
+                        rescored = True
+                    else:
+                        sched.at[priority, 'WeekPriorityScore'] = \
+                            scores.score(position, abs(sched.at[priority, 'DeltaWeeks']))
+
+                    ledger.remove(row_week, row['Hrs'], row['WeekTasks'])
+                    ledger.place(shift_week, row['Hrs'], row['WeekTasks'])
+                    week_positions[row_week].remove(position)
+                    bisect.insort(week_positions[shift_week], position)
+                    # Weeks only present because the schedule spilled into them drop out once emptied
+                    if not week_positions[row_week] and row_week not in master_weeks:
+                        ledger.uncover(row_week)
+                    if ledger.is_overbooked(shift_week):
+                        heapq.heappush(overbooked, shift_week)
+
+                else:
+                    print("Uncaught Error")
+
+        self.get_metrics().add_counts(resolved_weeks=resolved_weeks, window_expansions=window_expansions,
+                                      forward_shifts=forward_shifts, back_shifts=back_shifts,
+                                      hard_cap_hits=hard_cap_hits)
+
+        sched['WeekPriorityScore'].astype(float)
+        sched['DeltaDays'] = pd.eval('sched.DeltaWeeks*7')
+
+        return sched
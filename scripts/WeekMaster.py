@@ -1,5 +1,11 @@
+import os
+import numpy as np
 import pandas as pd
-import datetime as dt
+from .FrameCache import FrameCache
+
+
+# Bump when a change to the generators changes their output, to invalidate cached weeks masters
+_WEEKS_MASTER_CACHE_VERSION = 1
 
 
 def WeekMasterGenerator(start_year, end_year, reduced_hours=None, allowed_hours=80, allowed_tasks=12, output_dir=None):
@@ -10,27 +16,36 @@ def WeekMasterGenerator(start_year, end_year, reduced_hours=None, allowed_hours=
                                 freq='W-MON', inclusive='left')
 
     # Create first dataframe
-    weeks_master = pd.DataFrame(start_dates.isocalendar().to_dict('records'))
+    iso = start_dates.isocalendar()
+    weeks_master = pd.DataFrame({col: iso[col].to_numpy(dtype=np.int64) for col in ['year', 'week', 'day']})
     weeks_master['ScheduledWeek'] = start_dates
     weeks_master['AllowedHours'] = allowed_hours
     weeks_master['AllowedTasks'] = allowed_tasks
 
     # Add reduced hours
     if reduced_hours:
-        for start_date, end_date, hours, repetition, notes in reduced_hours:
-
-            date_range = (weeks_master['ScheduledWeek'] <= end_date) & (weeks_master['ScheduledWeek'] >= start_date)
-
-            if repetition == 'O':
-                weeks_master.loc[date_range, "AllowedHours"] = hours
-                weeks_master.loc[date_range, "NotesReducedHours"] = notes
-            elif repetition == 'Y':
-                # Iterating through the years
-                while start_date.year < end_year:
-                    weeks_master.loc[date_range, "AllowedHours"] = hours
-                    weeks_master.loc[date_range, "NotesReducedHours"] = notes
-                    start_date = dt.datetime(start_date.year + 1, start_date.month, start_date.day)
-                    end_date = dt.datetime(end_date.year + 1, end_date.month, end_date.day)
+        rule_index, rule_starts, rule_ends = ExpandRules([(start_date, end_date, repetition)
+                                                          for start_date, end_date, hours, repetition, notes in reduced_hours],
+                                                         end_year)
+
+        # Weeks whose Monday falls within each interval, as [first, last) positions into weeks_master
+        mondays = start_dates.to_numpy()
+        first = np.searchsorted(mondays, rule_starts, side='left')
+        last = np.maximum(np.searchsorted(mondays, rule_ends, side='right'), first)
+        lengths = last - first
+        positions = np.repeat(first, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+
+        # Later rules take precedence over earlier ones on the weeks they share
+        rule_of_week = np.full(len(weeks_master), -1)
+        np.maximum.at(rule_of_week, positions, np.repeat(rule_index, lengths))
+        reduced = rule_of_week >= 0
+
+        hours = np.array([rule[2] for rule in reduced_hours])
+        notes = np.array([rule[4] for rule in reduced_hours], dtype=object)
+        allowed = weeks_master["AllowedHours"].to_numpy().astype(np.result_type(weeks_master["AllowedHours"].dtype, hours.dtype))
+        allowed[reduced] = hours[rule_of_week[reduced]]
+        weeks_master["AllowedHours"] = allowed
+        weeks_master["NotesReducedHours"] = np.where(reduced, notes[rule_of_week], np.nan)
 
     # Create a csv if required
     if not output_dir == None:
@@ -40,39 +55,23 @@ def WeekMasterGenerator(start_year, end_year, reduced_hours=None, allowed_hours=
 
 
 def BlackoutDatesGenerator(end_year, dates, output_dir=None):
-    # dates: List of (start date, end date, repetition) tuples
-
-    # Empty lists for date collection
-    date_list = []
-    iso_info = []
-    info = []
-
-    for start_date, end_date, repetition, notes in dates:
-
-        # Add yearly repeating blackout dates
-        if repetition == "Y":
-            while start_date.year < end_year:
-                # Add dates to final lists
-                temp_dates = pd.date_range(start=start_date, end=end_date, freq='D')
-                date_list += temp_dates.to_list()
-                iso_info += temp_dates.isocalendar().to_dict('records')
-                info += [notes] * len(temp_dates)
-
-                # Iterate through years
-                start_date = dt.datetime(start_date.year + 1, start_date.month, start_date.day)
-                end_date = dt.datetime(end_date.year + 1, end_date.month, end_date.day)
-
-        # Add once off blackout dates
-        elif repetition == "O":
-            temp_dates = pd.date_range(start=start_date, end=end_date, freq='D')
-            date_list += temp_dates.to_list()
-            iso_info += temp_dates.isocalendar().to_dict('records')
-            info += [notes] * len(temp_dates)
-
-            # Create blackout date data frame
-    blackout_dates = pd.DataFrame(iso_info)
+    # dates: List of (start date, end date, repetition, notes) tuples
+
+    rule_index, rule_starts, rule_ends = ExpandRules([(start_date, end_date, repetition)
+                                                      for start_date, end_date, repetition, notes in dates], end_year)
+
+    # One row per day of every interval
+    day = np.timedelta64(1, 'D')
+    lengths = np.maximum((rule_ends - rule_starts) // day + 1, 0)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    date_list = pd.DatetimeIndex(np.repeat(rule_starts, lengths) + offsets * day)
+    info = np.array([notes for start_date, end_date, repetition, notes in dates], dtype=object)
+
+    # Create blackout date data frame
+    iso = date_list.isocalendar()
+    blackout_dates = pd.DataFrame({col: iso[col].to_numpy(dtype=np.int64) for col in ['year', 'week', 'day']})
     blackout_dates["Date"] = date_list
-    blackout_dates["NotesBlackout"] = info
+    blackout_dates["NotesBlackout"] = info[np.repeat(rule_index, lengths)]
 
     # Create a csv if required
     if not output_dir == None:
@@ -81,6 +80,48 @@ def BlackoutDatesGenerator(end_year, dates, output_dir=None):
     return blackout_dates
 
 
+def ExpandRules(rules, end_year):
+    """
+    Function to expand once off ('O') and yearly ('Y') date rules into date intervals, all at once.
+
+    rules: list of (start date, end date, repetition) tuples. A yearly rule repeats on the same month and day every
+    year from its start year up to (excluding) end_year; occurrences that do not exist (29 February) are skipped.
+    Rules with any other repetition are ignored.
+
+    Returns (rule index, interval start, interval end) np.ndarrays with one entry per interval, grouped by rule in
+    order and then by year, with datetime64[ns] starts and ends.
+    """
+    rule_index, years, starts, ends = [], [], [], []
+    for i, (start_date, end_date, repetition) in enumerate(rules):
+        start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+        if repetition == 'O':
+            rule_years = np.array([start_date.year])
+        elif repetition == 'Y':
+            rule_years = np.arange(start_date.year, end_year)
+        else:
+            continue
+        rule_index.append(np.full(len(rule_years), i))
+        years.append(rule_years)
+        starts.append(np.full(len(rule_years), start_date.to_datetime64()))
+        ends.append(np.full(len(rule_years), end_date.to_datetime64()))
+
+    if not rule_index:
+        empty = np.array([], dtype='datetime64[ns]')
+        return np.array([], dtype=np.int64), empty, empty
+
+    rule_index, years = np.concatenate(rule_index), np.concatenate(years)
+    starts, ends = pd.DatetimeIndex(np.concatenate(starts)), pd.DatetimeIndex(np.concatenate(ends))
+
+    # Move every interval to its year, keeping the month, day and time of day (and how many years it spans)
+    def in_year(dates, year_offset):
+        moved = pd.DataFrame({'year': years + year_offset, 'month': dates.month, 'day': dates.day})
+        return (pd.to_datetime(moved, errors='coerce') + (dates - dates.normalize())).to_numpy()
+
+    starts, ends = in_year(starts, 0), in_year(ends, (ends.year - starts.year).to_numpy())
+    valid = ~(np.isnat(starts) | np.isnat(ends))
+    return rule_index[valid], starts[valid], ends[valid]
+
+
 def WeeksMinusBlackout(weeks_master, blackout_dates, output_dir=None):
     # If note blackout dates return the original weeks_master
     if not blackout_dates.empty:
@@ -88,23 +129,27 @@ def WeeksMinusBlackout(weeks_master, blackout_dates, output_dir=None):
         # Initialize
         updated_weeks_master = weeks_master.copy()
 
-        # Join on weeks
-        joined_table = pd.merge(weeks_master, blackout_dates, on="week", suffixes=("_wm", "_bd"))
-
-        # Find the weeks with blackout dates
-        weeks_with_reduced_hours = joined_table.loc[
-            (joined_table['year_bd'] == joined_table['year_wm']),
-            ['year_wm', 'week', "NotesBlackout"]]
-
-        # Update hours
-        for index, row in weeks_with_reduced_hours.iterrows():
-            year = updated_weeks_master['year'] == row['year_wm']
-            week = updated_weeks_master['week'] == row['week']
-            daily_hours = weeks_master.loc[year & week, "AllowedHours"] / 5  # 5 days per week
-            greater_than_zero = updated_weeks_master['AllowedHours'] > 0
-
-            updated_weeks_master.loc[year & week & greater_than_zero, "AllowedHours"] -= daily_hours
-            updated_weeks_master.loc[year & week, "NotesBlackout"] = row['NotesBlackout']
+        # Count the blackout days in every (ISO year, ISO week) and keep the notes of the last one
+        week_index = pd.MultiIndex.from_frame(weeks_master[['year', 'week']])
+        num_days = blackout_dates.groupby(['year', 'week']).size().reindex(week_index, fill_value=0).to_numpy()
+        notes = blackout_dates.drop_duplicates(['year', 'week'], keep='last').set_index(['year', 'week'])["NotesBlackout"]
+        with_blackout = num_days > 0
+
+        if with_blackout.any():
+            # Update hours: each blackout day takes a fifth of the week's hours off (5 days per week), for as long as
+            # the week has hours left
+            daily_hours = weeks_master["AllowedHours"].to_numpy() / 5
+            allowed_hours = weeks_master["AllowedHours"].to_numpy(dtype=float, copy=True)
+            for day in range(num_days.max()):
+                reduced = (num_days > day) & (allowed_hours > 0)
+                allowed_hours[reduced] -= daily_hours[reduced]
+
+            # Keep integer hours as integers when every week still has a whole number of hours
+            if pd.api.types.is_integer_dtype(weeks_master["AllowedHours"]) and (allowed_hours % 1 == 0).all():
+                allowed_hours = allowed_hours.astype(weeks_master["AllowedHours"].dtype)
+
+            updated_weeks_master["AllowedHours"] = allowed_hours
+            updated_weeks_master.loc[with_blackout, "NotesBlackout"] = notes.reindex(week_index).to_numpy()[with_blackout]
     else:
         updated_weeks_master = weeks_master
 
@@ -148,7 +193,22 @@ def CSVDecoder(filepath, file=None):
 # Same start and end date
 
 def CreateWeeksMaster(start_year, end_year, allowed_hours, allowed_tasks, blackouts_directory, output_directory,
-                      reducedhrs_directory=None):
+                      reducedhrs_directory=None, cache_dir=None, cache_max_bytes=256 * 2**20):
+    # With a cache_dir, the final weeks master is cached under a hash of the parameters and the contents of the
+    # blackouts and reduced hours CSVs. On a cache hit nothing is regenerated and no CSVs are rewritten, except
+    # WeeksMasterFinal.csv when it is missing from output_directory.
+    if cache_dir is not None:
+        cache = FrameCache(cache_dir, max_bytes=cache_max_bytes)
+        key = FrameCache.key("WeeksMaster", _WEEKS_MASTER_CACHE_VERSION, start_year, end_year, allowed_hours,
+                             allowed_tasks, FrameCache.file_digest(blackouts_directory),
+                             FrameCache.file_digest(reducedhrs_directory))
+        weeks_master_final = cache.get(key)
+        if weeks_master_final is not None:
+            if output_directory is not None and not os.path.exists(output_directory + "/WeeksMasterFinal.csv"):
+                weeks_master_final.drop(columns='HardCapped').to_csv(output_directory + "/WeeksMasterFinal.csv",
+                                                                     index=False)
+            return weeks_master_final
+
     dates = CSVDecoder(blackouts_directory, file="Blackouts")
 
     if reducedhrs_directory is not None and reducedhrs_directory != '':
@@ -166,6 +226,9 @@ def CreateWeeksMaster(start_year, end_year, allowed_hours, allowed_tasks, blacko
 
     weeks_master_final['HardCapped'] = 0
 
+    if cache_dir is not None:
+        cache.put(key, weeks_master_final)
+
     return weeks_master_final
 
 
@@ -0,0 +1,220 @@
+"""
+Regression checks of scheduler edge cases on small synthetic inputs. Every check raises an AssertionError on failure.
+
+Usage: python -m scripts.benchmarks.regressions [check ...]
+"""
+import io
+import sys
+import random
+import contextlib
+import numpy as np
+import pandas as pd
+from ..AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from ..BottomUpBackScheduler import BottomUpBackScheduler
+from ..BottomUpFBScheduler import BottomUpFBScheduler
+from ..TopDownBackScheduler import TopDownBackScheduler
+from ..LocalSearch import LocalSearch
+from ..OptimalScheduler import milp
+from ..Scheduler import SCHEDULERS, get_scheduler
+from ..SharedInputs import SharedScheduleInputs
+from ..utils import frame_to_columns, columns_to_frame
+from ..WeekMaster import WeekMasterGenerator, BlackoutDatesGenerator, WeeksMinusBlackout
+from .synthetic import make_clean_df, make_weeks_master
+
+
+def check_empty_heaps(num_tasks=40, forecast_years=3, seed=0):
+    """
+    Check that the bottom-up schedulers still handle an empty task heap: a reschedule that only removes tasks, a
+    calendar reschedule where no week ends up overbooked, and create_schedule on an empty task list.
+    """
+    clean_df = make_clean_df(num_tasks, seed=seed)
+    wm_df = make_weeks_master(clean_df, forecast_years=forecast_years)
+    removed = clean_df["Key"].iloc[:num_tasks // 4].tolist()
+
+    for scheduler_class in (BottomUpBackScheduler, BottomUpFBScheduler):
+        name = scheduler_class.__name__
+        scheduler = scheduler_class()
+        sched = scheduler.create_schedule(clean_df, wm_df, forecast_years)
+
+        kept_df = clean_df.loc[~clean_df["Key"].isin(removed)]
+        resched = scheduler.reschedule(sched, kept_df, wm_df, forecast_years, removed=removed)
+        assert len(resched) == (~sched["Key"].isin(removed)).sum() and not resched["Key"].isin(removed).any(), \
+            f"{name}.reschedule() did not just drop the removed tasks!"
+
+        resched = scheduler.reschedule(sched, clean_df.iloc[:0], wm_df, forecast_years,
+                                       removed=clean_df["Key"].tolist())
+        assert resched.empty, f"{name}.reschedule() of every task removed is not empty!"
+
+        resched, report = scheduler.reschedule_calendar(sched, wm_df, wm_df)
+        assert resched.equals(sched) and report.empty, f"{name}.reschedule_calendar() moved tasks of an unchanged calendar!"
+
+        empty_sched = scheduler.create_schedule(clean_df.iloc[:0], wm_df, forecast_years)
+        assert empty_sched.empty, f"{name}.create_schedule() of an empty task list is not empty!"
+
+
+def check_local_search_overflow(num_tasks=60, forecast_years=2, cut_weeks=8, load=0.97, seed=0, seconds=1.0):
+    """
+    Check that LocalSearch improves a top-down schedule whose tasks run past the end of the weeks master (cut
+    cut_weeks before the forecast end), leaving the occurrences outside the weeks master where they are.
+    """
+    clean_df = make_clean_df(num_tasks, seed=seed)
+    wm_df = make_weeks_master(clean_df, forecast_years=forecast_years, load=load)
+    wm_end = pd.Timestamp.today() + pd.DateOffset(years=forecast_years) - pd.Timedelta(weeks=cut_weeks)
+    wm_df = wm_df.loc[wm_df["ScheduledWeek"] < wm_end].reset_index(drop=True)
+
+    sched = TopDownBackScheduler().create_schedule(clean_df, wm_df, forecast_years, {})
+    outside = sched["ScheduledWeek"] > wm_df["ScheduledWeek"].max()
+    assert outside.any(), "Top-down schedule does not overflow the weeks master, lower cut_weeks or raise load!"
+
+    search = LocalSearch(seconds=seconds, seed=seed)
+    improved = search.improve(sched, wm_df)
+    AbstractScheduleAlgorithm.check_valid_schedule(improved, wm_df, "LocalSearch")
+    assert improved.loc[improved["ScheduledWeek"] > wm_df["ScheduledWeek"].max()].sort_index().equals(
+        sched.loc[outside].sort_index()), "LocalSearch moved occurrences outside the weeks master!"
+    assert search.stats["local_search_drift_after"] <= search.stats["local_search_drift_before"], \
+        "LocalSearch increased the drift!"
+
+
+def _valid_schedule_reference(sched, wm_df):
+    # check_valid_schedule before it was vectorized: filter the schedule for every week of the weeks master, reporting
+    # the violating weeks instead of asserting on the first one
+    rows = []
+    for week in wm_df.to_dict('records'):
+        tasks = sched.loc[sched["ScheduledWeek"] == week["ScheduledWeek"]]
+        if tasks["Hrs"].sum() > week["AllowedHours"] or len(tasks) > week["AllowedTasks"]:
+            rows.append((week["ScheduledWeek"], tasks["Hrs"].sum(), len(tasks), week["AllowedHours"],
+                         week["AllowedTasks"]))
+    return pd.DataFrame(rows, columns=["ScheduledWeek", "ScheduledHours", "ScheduledTasks", "AllowedHours",
+                                       "AllowedTasks"])
+
+
+def check_valid_schedule_report(num_tasks=60, forecast_years=2, cut_weeks=8, load=0.97, num_tightened=10, seed=0):
+    """
+    Check AbstractScheduleAlgorithm.check_valid_schedule against the per-week loop it replaced, on a top-down schedule
+    that overflows its weeks master (weeks outside the weeks master are not checked), first as is and then with the
+    capacity of num_tightened of its weeks lowered below what is scheduled in them.
+    """
+    clean_df = make_clean_df(num_tasks, seed=seed)
+    wm_df = make_weeks_master(clean_df, forecast_years=forecast_years, load=load)
+    wm_end = pd.Timestamp.today() + pd.DateOffset(years=forecast_years) - pd.Timedelta(weeks=cut_weeks)
+    wm_df = wm_df.loc[wm_df["ScheduledWeek"] < wm_end].reset_index(drop=True)
+    sched = TopDownBackScheduler().create_schedule(clean_df, wm_df, forecast_years, {})
+    assert (sched["ScheduledWeek"] > wm_df["ScheduledWeek"].max()).any(), \
+        "Top-down schedule does not overflow the weeks master, lower cut_weeks or raise load!"
+
+    report = AbstractScheduleAlgorithm.check_valid_schedule(sched, wm_df, "Overflowing", raise_on_violation=False)
+    assert report.empty and _valid_schedule_reference(sched, wm_df).empty, \
+        "Weeks outside the weeks master were checked!"
+
+    # Take away an hour or a task more than is scheduled in some busy weeks
+    rng = np.random.default_rng(seed)
+    busy = np.flatnonzero(wm_df["ScheduledWeek"].isin(sched["ScheduledWeek"]).to_numpy())
+    tightened = np.sort(rng.choice(busy, size=min(num_tightened, len(busy)), replace=False))
+    week_load = sched.groupby("ScheduledWeek")["Hrs"].agg(["sum", "count"])
+    tight_df = wm_df.copy()
+    for position in tightened.tolist():
+        scheduled = week_load.loc[tight_df.at[position, "ScheduledWeek"]]
+        if position % 2:
+            tight_df.at[position, "AllowedHours"] = scheduled["sum"] - 1
+        else:
+            tight_df.at[position, "AllowedTasks"] = scheduled["count"] - 1
+
+    report = AbstractScheduleAlgorithm.check_valid_schedule(sched, tight_df, "Tightened", raise_on_violation=False)
+    pd.testing.assert_frame_equal(report, _valid_schedule_reference(sched, tight_df), check_dtype=False,
+                                  obj="check_valid_schedule report")
+    assert len(report) == len(tightened), "check_valid_schedule did not report every tightened week!"
+    try:
+        AbstractScheduleAlgorithm.check_valid_schedule(sched, tight_df, "Tightened")
+    except AssertionError as e:
+        assert str(report["ScheduledWeek"].iloc[0]) in str(e), "check_valid_schedule did not name the first failing week!"
+    else:
+        raise AssertionError("check_valid_schedule did not raise on violations!")
+
+
+def _weeks_minus_blackout_reference(weeks_master, blackout_dates):
+    # WeeksMinusBlackout before it was vectorized: one blackout day at a time with iterrows
+    if blackout_dates.empty:
+        return weeks_master
+    updated_weeks_master = weeks_master.copy()
+    joined_table = pd.merge(weeks_master, blackout_dates, on="week", suffixes=("_wm", "_bd"))
+    weeks_with_reduced_hours = joined_table.loc[(joined_table['year_bd'] == joined_table['year_wm']),
+                                                ['year_wm', 'week', "NotesBlackout"]]
+    for index, row in weeks_with_reduced_hours.iterrows():
+        year = updated_weeks_master['year'] == row['year_wm']
+        week = updated_weeks_master['week'] == row['week']
+        daily_hours = weeks_master.loc[year & week, "AllowedHours"] / 5
+        greater_than_zero = updated_weeks_master['AllowedHours'] > 0
+        updated_weeks_master.loc[year & week & greater_than_zero, "AllowedHours"] -= daily_hours
+        updated_weeks_master.loc[year & week, "NotesBlackout"] = row['NotesBlackout']
+    return updated_weeks_master
+
+
+def check_weeks_minus_blackout(num_calendars=40, seed=0):
+    """
+    Check WeeksMinusBlackout against the iterrows implementation it replaced, on random calendars of once off and
+    yearly blackout rules (overlapping days, missing notes, integer and non-integer weekly hours), and that it leaves
+    the weeks master it is given unchanged. Integer AllowedHours may stay integers where the reference made floats,
+    so dtypes are not compared.
+    """
+    rng = random.Random(seed)
+    for calendar in range(num_calendars):
+        start_year = 2024
+        wm_df = WeekMasterGenerator(start_year, start_year + rng.randint(1, 4), allowed_hours=rng.choice([80, 37, 42.5]))
+        rules = []
+        for k in range(rng.randint(1, 8)):
+            start = pd.Timestamp(start_year, 1, 1) + pd.Timedelta(days=rng.randrange(900))
+            rules.append((start, start + pd.Timedelta(days=rng.randrange(12)), rng.choice("OY"),
+                          rng.choice([f"Blackout {k}", None])))
+        blackout_dates = BlackoutDatesGenerator(int(wm_df["year"].max()) + 1, rules)
+
+        original = wm_df.copy()
+        updated = WeeksMinusBlackout(wm_df, blackout_dates)
+        assert wm_df.equals(original), f"WeeksMinusBlackout modified the weeks master of calendar {calendar}!"
+        pd.testing.assert_frame_equal(updated, _weeks_minus_blackout_reference(wm_df, blackout_dates),
+                                      check_dtype=False, obj=f"WeeksMinusBlackout of calendar {calendar}")
+
+
+def check_shared_inputs_views(num_tasks=150, forecast_years=2, seed=0):
+    """
+    Check that the frames resolve_inputs() builds from a SharedScheduleInputs bundle do not copy it: every numeric and
+    datetime column is a view into the shared block and string columns are Categoricals. Every algorithm must then
+    schedule the bundle (whose views are read-only) exactly as it schedules the original frames, once the schedules
+    went through the frame_to_columns() payload workers send back.
+    """
+    clean_df = make_clean_df(num_tasks, seed=seed, num_trades=2)
+    wm_df = make_weeks_master(clean_df, forecast_years=forecast_years)
+
+    with SharedScheduleInputs.create(clean_df, wm_df) as inputs:
+        block = np.frombuffer(inputs.shm.buf, dtype=np.uint8)
+        for frame_name, df in zip(("tasks", "weeks"), AbstractScheduleAlgorithm.resolve_inputs(inputs, None)):
+            for col in df.columns:
+                assert df[col].dtype != object, f"String column {col} of the {frame_name} frame is not a Categorical!"
+                # Nullable extension columns (e.g. UInt32) are rebuilt with a mask, and so copied
+                if isinstance(df[col].dtype, np.dtype):
+                    assert np.shares_memory(df[col].to_numpy(), block), f"Column {col} of the {frame_name} frame is a copy!"
+        del block, df
+
+        for name in SCHEDULERS:
+            if name == "optimal" and milp is None:
+                continue
+            with contextlib.redirect_stdout(io.StringIO()):
+                shared_sched = get_scheduler(name).create_schedule(inputs, None, forecast_years, {})
+                sched = get_scheduler(name).create_schedule(clean_df, wm_df.copy(), forecast_years, {})
+            assert columns_to_frame(frame_to_columns(shared_sched)).equals(
+                columns_to_frame(frame_to_columns(sched))), f"{name} schedules the shared inputs differently!"
+            del shared_sched
+
+
+CHECKS = {
+    "empty_heaps": check_empty_heaps,
+    "local_search_overflow": check_local_search_overflow,
+    "weeks_minus_blackout": check_weeks_minus_blackout,
+    "valid_schedule_report": check_valid_schedule_report,
+    "shared_inputs_views": check_shared_inputs_views,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or CHECKS:
+        CHECKS[name]()
+        print(f"{name}: ok")
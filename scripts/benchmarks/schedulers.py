@@ -0,0 +1,139 @@
+"""
+Benchmark of create_schedule for every scheduling algorithm on synthetic inputs of growing size.
+
+Usage: python -m scripts.benchmarks.schedulers [--sizes N ...] [--algorithms NAME ...] [--output results.json]
+                                               [--baseline baseline.json]
+"""
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import contextlib
+import tracemalloc
+import numpy as np
+import pandas as pd
+from ..Scheduler import SCHEDULERS, get_scheduler
+from .synthetic import make_clean_df, make_weeks_master
+
+
+def run(sizes=(100, 1000), algorithms=None, forecast_years=10, load=0.9, seed=0, hardcap={}, memory=True,
+        validate=True, **synthetic_options):
+    """
+    Time create_schedule for each algorithm on a synthetic task list (see make_clean_df) of each number of tasks in
+    sizes, with a matching weeks master (see make_weeks_master).
+
+    With memory=True every run is repeated under tracemalloc to record the peak traced memory, so that tracing does
+    not slow down the timed run. synthetic_options are passed on to make_clean_df (e.g. num_trades,
+    sequence_weights, hrs_distribution). A run that fails (e.g. on a hard cap assertion) is recorded with its error.
+    """
+    algorithms = list(algorithms or SCHEDULERS)
+
+    results = []
+    for size in sizes:
+        clean_df = make_clean_df(size, seed=seed, **synthetic_options)
+        wm_df = make_weeks_master(clean_df, forecast_years=forecast_years, load=load)
+
+        for algorithm in algorithms:
+            result = {"algorithm": algorithm, "tasks": size, "occurrences": None, "seconds": None,
+                      "peak_mb": None, "error": ""}
+            try:
+                start = time.perf_counter()
+                sched = _create_schedule(algorithm, clean_df, wm_df, forecast_years, hardcap, seed, validate)
+                result["seconds"] = time.perf_counter() - start
+                result["occurrences"] = len(sched)
+                del sched
+
+                if memory:
+                    tracemalloc.start()
+                    try:
+                        _create_schedule(algorithm, clean_df, wm_df, forecast_years, hardcap, seed, validate)
+                        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+                    finally:
+                        tracemalloc.stop()
+            except Exception as e:
+                result["error"] = repr(e)
+            results.append(result)
+    return results
+
+
+def _create_schedule(algorithm, clean_df, wm_df, forecast_years, hardcap, seed, validate):
+    # Same random state for every run (TopDownFBScheduler draws from random), and without the validation prints
+    random.seed(seed)
+    scheduler = get_scheduler(algorithm)
+    scheduler.validate = validate
+    with contextlib.redirect_stdout(io.StringIO()):
+        return scheduler.create_schedule(clean_df.copy(), wm_df.copy(), forecast_years=forecast_years, hardcap=hardcap)
+
+
+def save(results, path, **settings):
+    """
+    Function to save benchmark results as JSON, with the settings they were run with and the environment.
+    """
+    payload = {
+        "created": pd.Timestamp.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "settings": settings,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2)
+
+
+def compare(results, baseline_path):
+    """
+    Function to compare benchmark results against a baseline saved with save().
+
+    Returns a DataFrame with a row per (algorithm, tasks) in results, and the baseline seconds and peak memory next to
+    the new ones with their ratios (new / baseline, so below 1 is an improvement).
+    """
+    with open(baseline_path) as f:
+        baseline = pd.DataFrame(json.load(f)["results"])
+    current = pd.DataFrame(results)
+
+    comparison = current.merge(baseline[["algorithm", "tasks", "seconds", "peak_mb"]], on=["algorithm", "tasks"],
+                               how="left", suffixes=("", "_baseline"))
+    comparison["seconds_ratio"] = comparison["seconds"] / comparison["seconds_baseline"]
+    comparison["peak_mb_ratio"] = comparison["peak_mb"] / comparison["peak_mb_baseline"]
+    return comparison[["algorithm", "tasks", "seconds_baseline", "seconds", "seconds_ratio",
+                       "peak_mb_baseline", "peak_mb", "peak_mb_ratio"]]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark create_schedule of every scheduling algorithm.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="numbers of tasks")
+    parser.add_argument("--algorithms", nargs="+", choices=list(SCHEDULERS), help="default: all of them")
+    parser.add_argument("--forecast-years", type=int, default=10)
+    parser.add_argument("--load", type=float, default=0.9, help="average booked fraction of a week's capacity")
+    parser.add_argument("--num-trades", type=int, default=1)
+    parser.add_argument("--hrs-distribution", choices=["uniform", "geometric"], default="uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc peak memory runs")
+    parser.add_argument("--no-validate", action="store_true", help="skip validating the schedules")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON file of earlier results to compare against")
+    args = parser.parse_args(argv)
+
+    settings = {"sizes": args.sizes, "algorithms": args.algorithms, "forecast_years": args.forecast_years,
+                "load": args.load, "num_trades": args.num_trades, "hrs_distribution": args.hrs_distribution,
+                "seed": args.seed, "validate": not args.no_validate}
+    results = run(args.sizes, algorithms=args.algorithms, forecast_years=args.forecast_years, load=args.load,
+                  seed=args.seed, memory=not args.no_memory, validate=not args.no_validate,
+                  num_trades=args.num_trades, hrs_distribution=args.hrs_distribution)
+
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(pd.DataFrame(results).to_string(index=False))
+        if args.baseline:
+            print()
+            print(compare(results, args.baseline).to_string(index=False))
+
+    if args.output:
+        save(results, args.output, **settings)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
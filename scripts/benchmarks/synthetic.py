@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+from ..WeekMaster import WeekMasterGenerator
+
+
+def make_clean_df(num_tasks, seed=0, task_sequence_weeks=(1, 2, 4, 13, 26, 52), max_hrs=8, num_trades=1,
+                  sequence_weights=None, hrs_distribution="uniform"):
+    """
+    Function to generate a synthetic task list with the same schema as clean_dataframe() output.
+
+    Parameters:
+    - num_tasks: int. Number of tasks (rows) to generate.
+    - seed: int. Default=0. Seed for the random generator, so runs are reproducible.
+    - task_sequence_weeks: tuple[int]. TaskSequence_Weeks values to draw from.
+    - max_hrs: int. Default=8. Hrs are drawn from [1, max_hrs).
+    - num_trades: int. Default=1. Number of distinct Trade values.
+    - sequence_weights: tuple[float]. Default=None. Relative frequency of each task_sequence_weeks value, uniform if
+      None.
+    - hrs_distribution: str. Default="uniform". "uniform" draws Hrs uniformly, "geometric" mostly draws short tasks
+      (half of them take 1 hour) with a long tail up to max_hrs - 1.
+    """
+    rng = np.random.default_rng(seed)
+    today = pd.Timestamp.today().normalize()
+
+    probabilities = None
+    if sequence_weights is not None:
+        probabilities = np.asarray(sequence_weights, dtype=float) / np.sum(sequence_weights)
+    seq_weeks = rng.choice(np.asarray(task_sequence_weeks), size=num_tasks, p=probabilities)
+
+    if hrs_distribution == "uniform":
+        hrs = rng.integers(1, max_hrs, size=num_tasks)
+    elif hrs_distribution == "geometric":
+        hrs = np.minimum(rng.geometric(0.5, size=num_tasks), max_hrs - 1)
+    else:
+        raise ValueError(f"Unknown hrs_distribution {hrs_distribution}, expected 'uniform' or 'geometric'")
+
+    # First occurrence somewhere within one task sequence from today
+    consolidated_dates = today + pd.to_timedelta(rng.integers(0, seq_weeks * 7), unit='D')
+    iso = consolidated_dates.isocalendar()
+
+    df = pd.DataFrame({
+        "Key": np.arange(num_tasks),
+        "DataSource": [f"ASSET-{i % max(num_tasks // 4, 1)}" for i in range(num_tasks)],
+        "TaskDescription": [f"Synthetic task {i}" for i in range(num_tasks)],
+        "TaskSequence": [f"{weeks}W" for weeks in seq_weeks],
+        "TaskSequence_Weeks": seq_weeks,
+        "Trade": [f"TRADE-{i % num_trades}" for i in range(num_tasks)],
+        "Hrs": hrs,
+        "Year": iso.year.to_numpy(dtype=np.int64),
+        "Week": iso.week.to_numpy(dtype=np.int64),
+        "ConsolidatedDates": consolidated_dates,
+        "EstimatedLastServiceDate": consolidated_dates - pd.to_timedelta(seq_weeks * 7, unit='D'),
+    })
+    return df
+
+
+def make_weeks_master(clean_df, forecast_years=10, load=0.9):
+    """
+    Function to generate a weeks master (WeekMasterGenerator output, plus HardCapped) covering the forecast of
+    clean_df, with capacities sized so that the average week is booked at load times its allowed hours and tasks.
+
+    Every week gets at least enough hours for the longest task. The weeks master starts a year before today and ends
+    two years after the forecast, so tasks pushed past the forecast end still fit.
+    """
+    seq_weeks = clean_df["TaskSequence_Weeks"].to_numpy(dtype=float)
+    hours_per_week = (clean_df["Hrs"].to_numpy() / seq_weeks).sum()
+    tasks_per_week = (1 / seq_weeks).sum()
+
+    start_year = pd.Timestamp.today().year - 1
+    wm_df = WeekMasterGenerator(start_year, start_year + forecast_years + 3,
+                                allowed_hours=max(int(np.ceil(hours_per_week / load)), int(clean_df["Hrs"].max())),
+                                allowed_tasks=max(int(np.ceil(tasks_per_week / load)), 1))
+    wm_df["HardCapped"] = 0
+    return wm_df
@@ -0,0 +1,47 @@
+"""
+Benchmark of TopDownBackScheduler.do_weekly_hour_cap scaling with the number of task occurrences.
+
+Usage: python -m scripts.benchmarks.weekly_hour_cap [occurrences ...]
+"""
+import sys
+import time
+import numpy as np
+from ..AbstractScheduleAlgorithm import AbstractScheduleAlgorithm
+from ..TopDownBackScheduler import TopDownBackScheduler
+from ..WeekMaster import WeekMasterGenerator
+from .synthetic import make_clean_df
+
+
+def run(sizes=(1000, 10000, 100000), forecast_years=10, load=0.9, seed=0):
+    """
+    Time do_weekly_hour_cap on synthetic base schedules of (approximately) each number of occurrences in sizes.
+    Weekly capacities are set so that the average week is booked at load times its allowed hours and tasks.
+    """
+    task_sequence_weeks = (1, 2, 4, 13, 26, 52)
+    occurrences_per_task = np.mean([52 * forecast_years / weeks for weeks in task_sequence_weeks])
+
+    results = []
+    for size in sizes:
+        clean_df = make_clean_df(max(int(size / occurrences_per_task), 1), seed=seed,
+                                 task_sequence_weeks=task_sequence_weeks)
+        base_sched = AbstractScheduleAlgorithm.build_base_top_down_schedule(clean_df, forecast_years=forecast_years)
+        base_sched = base_sched.head(size)
+
+        week_load = base_sched.groupby('ScheduledWeek')['Hrs'].agg(['sum', 'count']).mean()
+        wm_df = WeekMasterGenerator(base_sched['ScheduledWeek'].min().year, base_sched['ScheduledWeek'].max().year + 2,
+                                    allowed_hours=int(week_load['sum'] / load), allowed_tasks=int(week_load['count'] / load))
+
+        start = time.perf_counter()
+        TopDownBackScheduler().do_weekly_hour_cap(base_sched, wm_df)
+        elapsed = time.perf_counter() - start
+
+        results.append({"occurrences": len(base_sched), "seconds": elapsed,
+                        "us_per_occurrence": 1e6 * elapsed / len(base_sched)})
+    return results
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or (1000, 10000, 100000)
+    print(f"{'occurrences':>12} {'seconds':>10} {'us/occurrence':>14}")
+    for result in run(sizes):
+        print(f"{result['occurrences']:>12} {result['seconds']:>10.3f} {result['us_per_occurrence']:>14.2f}")
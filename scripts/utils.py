@@ -1,30 +1,200 @@
+import os
+import re
+import gzip
+import functools
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-
-def write_to_sql(df):
-    server = "localhost"
-    database = "master"
-    driver = "ODBC Driver 17 for SQL Server"
-    db_con = f'mssql://@{server}/{database}?driver={driver}'
-    engine = create_engine(db_con)
-    df.to_sql('cleaned_data', engine, if_exists='replace')
-
-
-def read_from_sql(table_name):
-    server = "localhost"
-    database = "master"
-    driver = "ODBC Driver 17 for SQL Server"
-    db_con = f'mssql://@{server}/{database}?driver={driver}'
-    engine = create_engine(db_con)
-    df = pd.read_sql_table(table_name, engine)
-    return df
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine import make_url
+from .FrameCache import FrameCache
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Database the SQL helpers connect to unless given a URL, overridden by the SCHEDULER_DB_URL environment variable
+# (e.g. "sqlite:///schedule.db" to work locally)
+DEFAULT_DB_URL = "mssql://@localhost/master?driver=ODBC Driver 17 for SQL Server"
+DB_URL_ENV = "SCHEDULER_DB_URL"
+# Bound parameters per INSERT statement of a multi-row write, kept under the SQL Server limit of 2100
+SQL_MAX_PARAMETERS = 2000
+# Rows per executemany batch on SQL Server, which inserts them with pyodbc's fast_executemany
+SQL_EXECUTEMANY_ROWS = 10000
+# Columns identifying a row of a schedule table, matched by write_to_sql(if_exists="upsert")
+SCHEDULE_TABLE_KEYS = ("Key", "ScheduledWeek")
+
+# Columns of the raw task export used by clean_dataframe(), and the dtypes they are read with by load_task_list().
+# Numeric columns are left to inference, so that integer Hrs stay integers.
+TASK_CSV_COLUMNS = [
+    "Index", "Data Source", "Task Description", "Task Sequence", "Task Sequence (Weeks)",
+    "Trade", "Hrs", "Consolidated Dates"
+]
+TASK_CSV_DTYPES = {
+    "Data Source": str, "Task Description": str, "Task Sequence": str, "Trade": str, "Consolidated Dates": str,
+}
+# Characters stripped from the Long Text of the original task export in the final schedule
+LONG_TEXT_PATTERN = re.compile(r'[^A-Za-z0-9 \n.,_:;-]+')
+# Bump when a change to clean_dataframe() changes its output, to invalidate cached task lists
+_TASK_LIST_CACHE_VERSION = 1
+
+
+def get_engine(url=None):
+    """
+    Function to get the SQLAlchemy engine of a database URL, defaulting to $SCHEDULER_DB_URL and then DEFAULT_DB_URL.
+
+    Engines are created once per URL and reused, so every call shares the engine's connection pool.
+    """
+    return _create_engine(url or os.environ.get(DB_URL_ENV, DEFAULT_DB_URL))
+
+
+@functools.lru_cache(maxsize=None)
+def _create_engine(url):
+    options = {"pool_pre_ping": True}
+    if make_url(url).get_backend_name() == "mssql":
+        options["fast_executemany"] = True
+    return create_engine(url, **options)
+
+
+def write_to_sql(df, table_name="cleaned_data", if_exists="replace", url=None, chunksize=None, index=True,
+                 keys=SCHEDULE_TABLE_KEYS):
+    """
+    Function to write a DataFrame to a SQL table in chunks.
+
+    Rows are inserted in batches of chunksize: on SQL Server with executemany (fast_executemany, see get_engine()),
+    elsewhere with multi-row INSERTs of up to SQL_MAX_PARAMETERS values each.
+
+    Parameters:
+    - if_exists: str. Default="replace". "replace", "append" or "fail" as in DataFrame.to_sql, or "upsert" to
+      replace the rows of the table matching df on the keys columns and append the others. The upsert writes df to
+      a staging table first, then deletes and inserts in a single transaction.
+    - url: str. Default=None. Database URL, see get_engine().
+    - chunksize: int. Default=None. Rows per batch, by default as many as fit in a statement.
+    - keys: tuple. Default=("Key", "ScheduledWeek"). Columns identifying a row for if_exists="upsert".
+    """
+    engine = get_engine(url)
+    if if_exists != "upsert" or not inspect(engine).has_table(table_name):
+        _to_sql(df, table_name, engine, "replace" if if_exists == "upsert" else if_exists, chunksize, index)
+        return
+
+    staging_name = table_name + "_staging"
+    _to_sql(df, staging_name, engine, "replace", chunksize, index)
+    quote = engine.dialect.identifier_preparer.quote
+    table, staging = quote(table_name), quote(staging_name)
+    columns = ", ".join(quote(column) for column in ([df.index.name or "index"] if index else []) + list(df.columns))
+    matches = " AND ".join(f"{staging}.{quote(key)} = {table}.{quote(key)}" for key in keys)
+    try:
+        with engine.begin() as con:
+            con.execute(text(f"DELETE FROM {table} WHERE EXISTS (SELECT 1 FROM {staging} WHERE {matches})"))
+            con.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging}"))
+    finally:
+        with engine.begin() as con:
+            con.execute(text(f"DROP TABLE {staging}"))
+
 
+def _to_sql(df, table_name, engine, if_exists, chunksize, index):
+    if engine.dialect.name == "mssql":
+        method, chunksize = None, chunksize or SQL_EXECUTEMANY_ROWS
+    else:
+        method, chunksize = "multi", chunksize or max(1, SQL_MAX_PARAMETERS // (len(df.columns) + index))
+    df.to_sql(table_name, engine, if_exists=if_exists, index=index, chunksize=chunksize, method=method)
 
-def load_csv(filepath, index_col=None):
+
+def read_from_sql(table_name, url=None, chunksize=None, columns=None):
+    """
+    Function to read a SQL table into a DataFrame, see get_engine() for url.
+
+    With chunksize, returns an iterator of DataFrames of up to chunksize rows instead, streamed from a server side
+    cursor so that the table is never loaded whole.
+    """
+    engine = get_engine(url)
+    if chunksize is None:
+        return pd.read_sql_table(table_name, engine, columns=columns)
+    return _read_sql_chunks(table_name, engine, chunksize, columns)
+
+
+def _read_sql_chunks(table_name, engine, chunksize, columns):
+    with engine.connect().execution_options(stream_results=True) as con:
+        yield from pd.read_sql_table(table_name, con, columns=columns, chunksize=chunksize)
+
+
+def frame_to_columns(df):
+    """
+    Function to serialize a DataFrame into a compact columnar payload that pickles as raw array buffers:
+    numeric columns as np.ndarrays, datetimes as int64 nanoseconds and object (string) and categorical columns as
+    int32 codes plus a table of the unique values, rebuilt as object columns. The index is not kept. Use
+    columns_to_frame() to rebuild the DataFrame.
+    """
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_dtype(series.dtype):
+            columns[col] = ("datetime", series.to_numpy(dtype="datetime64[ns]").view(np.int64))
+        elif series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype):
+            codes, uniques = pd.factorize(series)
+            columns[col] = ("codes", codes.astype(np.int32), uniques.to_numpy(dtype=object))
+        elif isinstance(series.dtype, np.dtype):
+            columns[col] = ("array", series.to_numpy())
+        else:
+            columns[col] = ("array", series.array)
+    return {"columns": list(df.columns), "data": columns}
+
+
+def columns_to_frame(payload):
+    """
+    Function to rebuild the DataFrame serialized by frame_to_columns().
+    """
+    data = {}
+    for col in payload["columns"]:
+        kind, *values = payload["data"][col]
+        if kind == "datetime":
+            data[col] = values[0].view("datetime64[ns]")
+        elif kind == "codes":
+            codes, uniques = values
+            column = uniques.take(codes)
+            column[codes < 0] = np.nan
+            data[col] = column
+        else:
+            data[col] = values[0]
+    return pd.DataFrame(data, columns=payload["columns"])
+
+
+def load_csv(filepath, index_col=None, usecols=None, dtype=None):
     # Load CSV file as Pandas DataFrame
     # NOTE: There seems to be a bullet point character that can't be parsed. Loading with replacement character for now.
-    # TODO: Column type conversion?
-    df = pd.read_csv(filepath, index_col=index_col, encoding_errors="replace")
+    # Reading only usecols goes through the pyarrow parser when it is installed, falling back to the C parser on
+    # anything pyarrow rejects (such as that character, as it has no replacement mode).
+    if usecols is not None and pyarrow is not None:
+        try:
+            return pd.read_csv(filepath, index_col=index_col, usecols=usecols, dtype=dtype, engine="pyarrow")
+        except (ValueError, UnicodeDecodeError):
+            pass
+    df = pd.read_csv(filepath, index_col=index_col, usecols=usecols, dtype=dtype, encoding_errors="replace")
+    return df
+
+
+def load_task_list(filepath, max_allowed_hours=80, date_format=None, cache_dir=None, cache_max_bytes=256 * 2**20):
+    """
+    Function to load and clean the raw task export, i.e. clean_dataframe(load_csv(filepath)), reading only the
+    columns clean_dataframe() uses, with the dtypes of TASK_CSV_DTYPES.
+
+    With a cache_dir, the cleaned frame is cached (see FrameCache) under a hash of the contents of filepath and the
+    parameters, so later runs against the same export skip parsing entirely. The frame comes back with a RangeIndex
+    either way.
+    """
+    if cache_dir is not None:
+        cache = FrameCache(cache_dir, max_bytes=cache_max_bytes)
+        key = FrameCache.key("TaskList", _TASK_LIST_CACHE_VERSION, max_allowed_hours, date_format,
+                             FrameCache.file_digest(filepath))
+        df = cache.get(key)
+        if df is not None:
+            return df
+
+    raw_df = load_csv(filepath, usecols=TASK_CSV_COLUMNS, dtype=TASK_CSV_DTYPES)
+    df = clean_dataframe(raw_df, max_allowed_hours=max_allowed_hours, date_format=date_format).reset_index(drop=True)
+    if cache_dir is not None:
+        cache.put(key, df)
     return df
 
 def split_by_trade(df):
@@ -41,28 +211,24 @@ def split_by_trade(df):
     
     return DataFrameDict
 
-def clean_dataframe(raw_df, max_allowed_hours=80):
-    # Specify columns to extract
-    columns = [
-        "Index", "Data Source", "Task Description", "Task Sequence", "Task Sequence (Weeks)",
-        "Trade", "Hrs", "Consolidated Dates"
-    ]
-
+def clean_dataframe(raw_df, max_allowed_hours=80, date_format=None):
     # Extract relevant columns for processed table
-    df = raw_df[columns]
+    df = raw_df[TASK_CSV_COLUMNS].copy()
 
-    # Convert Consolidated Dates to datetime
+    # Convert Consolidated Dates to datetime, in one vectorized pass: with the given strftime date_format, or with the
+    # format inferred from the first date
     # TODO: Avoid hardcoding the name?
-    df["Consolidated Dates"] = df["Consolidated Dates"].apply(pd.to_datetime)
-
-    # Convert Task Sequence (Weeks) to a timeDelta so that we can manipulate dates in a vectorized manner
-
-    df["Task Sequence (Weeks)"] = pd.to_timedelta(df["Task Sequence (Weeks)"], unit='w')  # this gives days instead of weeks (which is probably fine anyway)
+    df["Consolidated Dates"] = pd.to_datetime(df["Consolidated Dates"], format=date_format,
+                                              infer_datetime_format=date_format is None)
 
     # Create relevant columns (Year, Week, Last Service Date) from Consolidated Dates column
-    df["Year"] = df["Consolidated Dates"].dt.isocalendar().year
-    df["Week"] = df["Consolidated Dates"].dt.isocalendar().week
-    df["Estimated Last Service Date"] = df["Consolidated Dates"] - df["Task Sequence (Weeks)"]
+    task_sequence = pd.to_timedelta(df["Task Sequence (Weeks)"], unit='w')
+    iso = df["Consolidated Dates"].dt.isocalendar()
+    df["Year"] = iso.year
+    df["Week"] = iso.week
+    df["Estimated Last Service Date"] = df["Consolidated Dates"] - task_sequence
+    # Whole number of weeks (fractional weeks are floored)
+    df["Task Sequence (Weeks)"] = task_sequence.dt.days.astype(int) // 7
 
     # Rename columns
     df = df.rename(columns={
@@ -93,7 +259,6 @@ def clean_dataframe(raw_df, max_allowed_hours=80):
         "ConsolidatedDates",
         "EstimatedLastServiceDate",
     ]]
-    df["TaskSequence_Weeks"] = df["TaskSequence_Weeks"].dt.days.astype(int) // 7  # Transform into # of weeks integer
     df = df.sort_values(by='Key')
 
     over_length_tasks = df[df["Hrs"] > max_allowed_hours]
@@ -102,31 +267,73 @@ def clean_dataframe(raw_df, max_allowed_hours=80):
 
     return df
 
-def split_by_trade(df):
-    UniqueNames = df.Trade.unique()
-    #create a data frame dictionary to store data frames
-    DataFrameDict = {elem : pd.DataFrame() for elem in UniqueNames}
-    for key in DataFrameDict.keys():
-        if 'Contractor Name' in df.keys():
-            DataFrameDict[key] = df[:][(df.Trade == key) & (df.ContractorName == "")]
-        else:
-            DataFrameDict[key] = df[:][df.Trade == key]
-    
-    return DataFrameDict
-def produce_final_schedule(df, original_csv, out_link):
-    df_original = load_csv(original_csv)
-    original_keys = list(df_original.columns.values)
+def produce_final_schedule(df, original_csv, out_link, chunksize=100000):
+    """
+    Function to join a schedule with the columns of the original task export that clean_dataframe() drops (Long Text,
+    ...) on Key, and write it to out_link.
+
+    The side table of those columns is read once per version of original_csv (see _load_side_table()) and reused by
+    later calls. The schedule is joined and written chunksize rows at a time, so memory stays flat as schedules grow.
+    The format follows the extension of out_link: ".csv", ".csv.gz" (gzip-compressed CSV) or ".parquet" (which needs
+    pyarrow).
+    """
+    side_df = _load_side_table(*_file_version(original_csv))
+    # Drop a leading index column written out with the schedule, but never the Key
+    if len(df.columns) and (df.columns[0] in ("index", "") or str(df.columns[0]).startswith("Unnamed:")):
+        df = df.iloc[:, 1:]
+
+    if out_link.endswith(".parquet"):
+        assert pyarrow is not None, "Writing the final schedule as parquet needs pyarrow!"
+        writer = None
+        try:
+            for chunk in _iter_final_schedule(df, side_df, chunksize):
+                table = pyarrow.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(out_link, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return
+
+    open_file = gzip.open if out_link.endswith(".gz") else open
+    with open_file(out_link, "wt", encoding="UTF-8", newline="") as f:
+        for i, chunk in enumerate(_iter_final_schedule(df, side_df, chunksize)):
+            chunk.to_csv(f, header=i == 0)
+
+
+def _iter_final_schedule(df, side_df, chunksize):
+    # Joined chunks in the row order of the schedule (an inner merge would group each chunk's rows by Key), numbered
+    # on from 0 as a single merge of the whole schedule would be
+    written = 0
+    for start in range(0, max(len(df), 1), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        chunk = pd.merge(chunk.assign(_row=np.arange(len(chunk))), side_df, on=['Key'])
+        chunk = chunk.sort_values(by='_row', kind='stable').drop(columns='_row')
+        if start == 0 or len(chunk):
+            chunk.index = pd.RangeIndex(written, written + len(chunk))
+            written += len(chunk)
+            yield chunk
+
+
+def _file_version(filepath):
+    stat = os.stat(filepath)
+    return os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size
+
+
+@functools.lru_cache(maxsize=8)
+def _load_side_table(filepath, mtime_ns, size):
+    """
+    Function to load the columns of the original task export joined onto the final schedule, cached per path,
+    modification time and size so that a changed export is read again.
+    """
+    df_original = load_csv(filepath)
     cols = [
         "Key", "Data Source", "Task Description", "Task Sequence", "Task Sequence (Weeks)",
         "Trade", "Hrs", "Consolidated Dates"
     ]
-    other_cols = []
-    for i in original_keys:
-        if i not in cols:
-            other_cols.append(i)
-    df_original_new = df_original[other_cols].copy()
-    df_original_new.rename(columns={'Index':'Key'}, inplace=True)
-    df_original_new['Long Text'] = df_original_new['Long Text'].apply(lambda x: re.sub(r'[^A-Za-z0-9 \n.,_:;-]+', '', x))
-    df = df.iloc[:, 1:]
-    df_final = pd.merge(df, df_original_new, on=['Key'])
-    df_final.to_csv(out_link, encoding='UTF-8')
\ No newline at end of file
+    other_cols = [col for col in df_original.columns if col not in cols]
+    side_df = df_original[other_cols].rename(columns={'Index': 'Key'})
+    if 'Long Text' in side_df.columns:
+        side_df['Long Text'] = side_df['Long Text'].str.replace(LONG_TEXT_PATTERN, '', regex=True)
+    return side_df